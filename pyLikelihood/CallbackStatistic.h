@@ -0,0 +1,177 @@
+/**
+ * @file CallbackStatistic.h
+ * @brief Statistic whose value and derivatives are computed by a
+ * python object.
+ *
+ * $Header$
+ */
+
+#ifndef pyLikelihood_CallbackStatistic_h
+#define pyLikelihood_CallbackStatistic_h
+
+#include <Python.h>
+
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+#include "optimizers/Arg.h"
+#include "optimizers/Parameter.h"
+#include "optimizers/Statistic.h"
+
+namespace pyLikelihood {
+
+/**
+ * @class CallbackStatistic
+ *
+ * @brief The parameters are held here, so that the optimizers can
+ * step through them as usual, while value() and getFreeDerivs() call
+ * the evaluator's value(x) and derivs(x) methods with the list of
+ * free parameter values.  This lets the pyLikelihood optimizers fit
+ * log-likelihoods that are not available as LogLike objects in this
+ * process, such as those of DistributedSummedLikelihood.
+ */
+
+class CallbackStatistic : public optimizers::Statistic {
+public:
+   CallbackStatistic(PyObject * evaluator)
+      : optimizers::Statistic("CallbackStatistic", 0),
+        m_evaluator(evaluator) {
+      Py_INCREF(m_evaluator);
+   }
+
+   virtual ~CallbackStatistic() {
+      Py_DECREF(m_evaluator);
+   }
+
+   void addParameter(const std::string & name, double value,
+                     double minValue, double maxValue, double scale,
+                     bool isFree) {
+      optimizers::Parameter par(name, value, minValue, maxValue, isFree);
+      par.setScale(scale);
+      m_parameter.push_back(par);
+   }
+
+   void clearParameters() {
+      m_parameter.clear();
+   }
+
+   virtual double value() const {
+      PyObject * result = call("value");
+      double my_value = PyFloat_AsDouble(result);
+      Py_DECREF(result);
+      checkError("value");
+      return my_value;
+   }
+
+   /// Both forms of the Arg overloads are provided, since the
+   /// optimizers versions differ in the constness of the argument.
+   virtual void getFreeDerivs(optimizers::Arg &,
+                              std::vector<double> & derivs) const {
+      getFreeDerivs(derivs);
+   }
+
+   virtual void getFreeDerivs(const optimizers::Arg &,
+                              std::vector<double> & derivs) const {
+      getFreeDerivs(derivs);
+   }
+
+   virtual void getFreeDerivs(std::vector<double> & derivs) const {
+      PyObject * result = call("derivs");
+      PyObject * items = PySequence_Fast(result, "derivs must be a sequence");
+      Py_DECREF(result);
+      checkError("derivs");
+      derivs.clear();
+      for (Py_ssize_t i(0); i < PySequence_Fast_GET_SIZE(items); i++) {
+         derivs.push_back(PyFloat_AsDouble(PySequence_Fast_GET_ITEM(items, i)));
+      }
+      Py_DECREF(items);
+      checkError("derivs");
+      if (derivs.size() != getNumFreeParams()) {
+         throw std::runtime_error("CallbackStatistic: derivs returned the "
+                                  "wrong number of values.");
+      }
+   }
+
+protected:
+
+   virtual double value(optimizers::Arg &) const {
+      return value();
+   }
+
+   virtual double value(const optimizers::Arg &) const {
+      return value();
+   }
+
+   virtual double derivByParamImp(optimizers::Arg &,
+                                  const std::string &) const {
+      throw std::runtime_error("CallbackStatistic::derivByParamImp: "
+                               "not implemented.");
+   }
+
+   virtual double derivByParamImp(const optimizers::Arg &,
+                                  const std::string &) const {
+      throw std::runtime_error("CallbackStatistic::derivByParamImp: "
+                               "not implemented.");
+   }
+
+   virtual optimizers::Function * clone() const {
+      return 0;
+   }
+
+private:
+
+   PyObject * m_evaluator;
+
+   /// Call the evaluator's method with the free parameter values and
+   /// return the new reference to the result.
+   PyObject * call(const char * method) const {
+      std::vector<double> values;
+      getFreeParamValues(values);
+      PyObject * x = PyList_New(values.size());
+      for (size_t i(0); i < values.size(); i++) {
+         PyList_SET_ITEM(x, i, PyFloat_FromDouble(values[i]));
+      }
+      PyObject * result = PyObject_CallMethod(m_evaluator,
+                                              const_cast<char *>(method),
+                                              const_cast<char *>("O"), x);
+      Py_DECREF(x);
+      if (result == 0) {
+         checkError(method);
+      }
+      return result;
+   }
+
+   /// Convert a pending python exception into a std::runtime_error,
+   /// which the wrappers turn back into a python RuntimeError.
+   static void checkError(const char * method) {
+      if (!PyErr_Occurred()) {
+         return;
+      }
+      PyObject * type(0), * value(0), * traceback(0);
+      PyErr_Fetch(&type, &value, &traceback);
+      std::string message(std::string("CallbackStatistic: ") + method);
+      PyObject * text = value ? PyObject_Str(value) : 0;
+      if (text != 0) {
+#if PY_MAJOR_VERSION >= 3
+         const char * chars = PyUnicode_AsUTF8(text);
+#else
+         const char * chars = PyString_AsString(text);
+#endif
+         if (chars != 0) {
+            message += std::string(": ") + chars;
+         }
+         Py_DECREF(text);
+      }
+      PyErr_Clear();
+      Py_XDECREF(type);
+      Py_XDECREF(value);
+      Py_XDECREF(traceback);
+      throw std::runtime_error(message);
+   }
+
+};
+
+} // namespace pyLikelihood
+
+#endif // pyLikelihood_CallbackStatistic_h
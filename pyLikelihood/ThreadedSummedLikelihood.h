@@ -0,0 +1,230 @@
+/**
+ * @file ThreadedSummedLikelihood.h
+ * @brief SummedLikelihood that evaluates its components concurrently.
+ *
+ * $Header$
+ */
+
+#ifndef pyLikelihood_ThreadedSummedLikelihood_h
+#define pyLikelihood_ThreadedSummedLikelihood_h
+
+#include <algorithm>
+#include <condition_variable>
+#include <exception>
+#include <functional>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+#include "Likelihood/LogLike.h"
+#include "Likelihood/SummedLikelihood.h"
+
+namespace pyLikelihood {
+
+/**
+ * @class ThreadedSummedLikelihood
+ *
+ * @brief The value and the free parameter derivatives are computed
+ * for the components by a pool of up to nthreads worker threads,
+ * which is started on the first evaluation and kept until the number
+ * of threads or components changes, and then summed in component
+ * order, so the results do not depend on the number of threads.
+ *
+ * Each component is evaluated by a single thread, but different
+ * components are evaluated at the same time, so this is only correct
+ * if the component LogLike objects share no mutable state (sources,
+ * functions or caches).  That is not guaranteed by the Likelihood
+ * library; compare against SummedLikelihood with
+ * SummedLikelihoodBenchmark.compareThreaded before relying on it.
+ */
+
+class ThreadedSummedLikelihood : public Likelihood::SummedLikelihood {
+public:
+   ThreadedSummedLikelihood(unsigned int nthreads=1)
+      : Likelihood::SummedLikelihood(), m_nthreads(nthreads),
+        m_numEvaluations(0), m_generation(0), m_pending(0),
+        m_stop(false) {}
+
+   ThreadedSummedLikelihood(const ThreadedSummedLikelihood &) = delete;
+
+   ThreadedSummedLikelihood &
+   operator=(const ThreadedSummedLikelihood &) = delete;
+
+   virtual ~ThreadedSummedLikelihood() {
+      stopWorkers();
+   }
+
+   /// The overloads of the base class that are not overridden here.
+   using Likelihood::SummedLikelihood::value;
+   using Likelihood::SummedLikelihood::getFreeDerivs;
+
+   void addComponent(Likelihood::LogLike & component) {
+      Likelihood::SummedLikelihood::addComponent(component);
+      m_components.push_back(&component);
+   }
+
+   void setNumThreads(unsigned int nthreads) {
+      stopWorkers();
+      m_nthreads = nthreads;
+   }
+
+   unsigned int numThreads() const {
+      return m_nthreads;
+   }
+
+   /// The number of calls to value() and getFreeDerivs(derivs) since
+   /// construction or the last reset, to check that an optimizer
+   /// goes through these methods.
+   unsigned long numEvaluations() const {
+      return m_numEvaluations;
+   }
+
+   void resetNumEvaluations() {
+      m_numEvaluations = 0;
+   }
+
+   virtual double value() const {
+      m_numEvaluations++;
+      if (m_nthreads < 2 || m_components.size() < 2) {
+         return Likelihood::SummedLikelihood::value();
+      }
+      std::vector<double> values(m_components.size());
+      run(&ThreadedSummedLikelihood::componentValue, values);
+      double my_value(0);
+      for (size_t i(0); i < values.size(); i++) {
+         my_value += values[i];
+      }
+      return my_value;
+   }
+
+   virtual void getFreeDerivs(std::vector<double> & derivs) const {
+      m_numEvaluations++;
+      if (m_nthreads < 2 || m_components.size() < 2) {
+         Likelihood::SummedLikelihood::getFreeDerivs(derivs);
+         return;
+      }
+      std::vector<std::vector<double> > freeDerivs(m_components.size());
+      run(&ThreadedSummedLikelihood::componentDerivs, freeDerivs);
+      derivs = freeDerivs[0];
+      for (size_t i(1); i < freeDerivs.size(); i++) {
+         for (size_t j(0); j < derivs.size(); j++) {
+            derivs.at(j) += freeDerivs[i].at(j);
+         }
+      }
+   }
+
+private:
+
+   unsigned int m_nthreads;
+
+   std::vector<Likelihood::LogLike *> m_components;
+
+   mutable unsigned long m_numEvaluations;
+
+   /// The worker pool.  run() publishes m_task and bumps m_generation;
+   /// each worker runs the task once per generation and the last one
+   /// to finish signals m_done.
+   mutable std::vector<std::thread> m_workers;
+   mutable std::mutex m_mutex;
+   mutable std::condition_variable m_start;
+   mutable std::condition_variable m_done;
+   mutable std::function<void(size_t)> m_task;
+   mutable unsigned long m_generation;
+   mutable size_t m_pending;
+   mutable bool m_stop;
+
+   static void componentValue(const Likelihood::LogLike * component,
+                              double & value) {
+      value = component->value();
+   }
+
+   static void componentDerivs(const Likelihood::LogLike * component,
+                               std::vector<double> & derivs) {
+      component->getFreeDerivs(derivs);
+   }
+
+   /// Apply func to the components, worker i taking components i,
+   /// i + nthreads, etc.  The first exception thrown by any worker is
+   /// rethrown after all of the workers have finished.
+   template <typename Result>
+   void run(void (*func)(const Likelihood::LogLike *, Result &),
+            std::vector<Result> & results) const {
+      startWorkers();
+      size_t nthreads(m_workers.size());
+      std::vector<std::exception_ptr> errors(nthreads);
+      std::unique_lock<std::mutex> lock(m_mutex);
+      m_task = [&, nthreads](size_t i) {
+         try {
+            for (size_t k(i); k < m_components.size(); k += nthreads) {
+               func(m_components[k], results[k]);
+            }
+         } catch (...) {
+            errors[i] = std::current_exception();
+         }
+      };
+      m_pending = nthreads;
+      m_generation++;
+      m_start.notify_all();
+      m_done.wait(lock, [this]() { return m_pending == 0; });
+      m_task = nullptr;
+      lock.unlock();
+      for (size_t i(0); i < nthreads; i++) {
+         if (errors[i]) {
+            std::rethrow_exception(errors[i]);
+         }
+      }
+   }
+
+   void workerLoop(size_t i, unsigned long generation) const {
+      while (true) {
+         std::function<void(size_t)> task;
+         {
+            std::unique_lock<std::mutex> lock(m_mutex);
+            m_start.wait(lock, [&]() {
+                  return m_stop || m_generation != generation;
+               });
+            if (m_stop) {
+               return;
+            }
+            generation = m_generation;
+            task = m_task;
+         }
+         task(i);
+         std::lock_guard<std::mutex> lock(m_mutex);
+         if (--m_pending == 0) {
+            m_done.notify_one();
+         }
+      }
+   }
+
+   void startWorkers() const {
+      size_t nthreads(std::min(static_cast<size_t>(m_nthreads),
+                               m_components.size()));
+      if (m_workers.size() == nthreads) {
+         return;
+      }
+      stopWorkers();
+      for (size_t i(0); i < nthreads; i++) {
+         m_workers.push_back(std::thread(&ThreadedSummedLikelihood::workerLoop,
+                                         this, i, m_generation));
+      }
+   }
+
+   void stopWorkers() const {
+      {
+         std::lock_guard<std::mutex> lock(m_mutex);
+         m_stop = true;
+      }
+      m_start.notify_all();
+      for (size_t i(0); i < m_workers.size(); i++) {
+         m_workers[i].join();
+      }
+      m_workers.clear();
+      m_stop = false;
+   }
+
+};
+
+} // namespace pyLikelihood
+
+#endif // pyLikelihood_ThreadedSummedLikelihood_h
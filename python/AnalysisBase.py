@@ -8,11 +8,13 @@ Base class for Likelihood analysis Python modules.
 #
 
 import sys
-import yaml
 import numpy as num
 import pyLikelihood as pyLike
 from SrcModel import SourceModel
 from LikelihoodState import LikelihoodState
+from ProfileCache import ProfileCache
+from CovarianceView import CovarianceView
+from FluxDensity import spectrumValues, spectrumDerivs
 
 try:
     from SimpleDialog import SimpleDialog, map, Param
@@ -27,6 +29,7 @@ class AnalysisBase(object):
         self.maxdist = 20
         self.tol = 1e-3
         self.covariance = None
+        self._covarianceView = None
         self.covar_is_current = False
         self.tolType = pyLike.ABSOLUTE
         self.optObject = None
@@ -126,11 +129,7 @@ class AnalysisBase(object):
             self.covar_is_current = True
         else:
             self.covar_is_current = False
-        j = 0
-        for i in range(len(self.model.params)):
-            if self.model[i].isFree():
-                self.model[i].setError(errors[j])
-                j += 1
+        self.model.setErrors(errors)
         return errors
     def minosError(self, *args):
 
@@ -166,17 +165,7 @@ class AnalysisBase(object):
         parameter identified by "parName" for a specific source
         identified by "srcName".'''
         
-        source_names = self.sourceNames()
-        par_index = -1
-        for src in source_names:
-            pars = pyLike.ParameterVector()
-            self[src].src.spectrum().getParams(pars)
-            for par in pars:
-                par_index += 1
-                if src == srcName and par.getName() == parName:
-                    return par_index
-        raise RuntimeError("Parameter %s for source %s not found."
-                           % (parName, srcName))
+        return self.model.par_index(srcName, parName)
     def _minosIndexError(self, par_index, level=1):
         if self.optObject is None:
             raise RuntimeError("To evaluate minos errors, a fit must first be "
@@ -232,7 +221,6 @@ class AnalysisBase(object):
         saved_state = LikelihoodState(self)
         if verbosity > 0:
             print ("*** Start Ts_dl ***")
-        source_attributes = self.getExtraSourceAttributes()
         self.logLike.syncParams()
         src = self.logLike.getSource(srcName)
         freeParams = pyLike.DoubleVector()
@@ -243,11 +231,71 @@ class AnalysisBase(object):
         n_free_base = n_free_test - n_free_src
 
         logLike1 = self.logLike.value()
+        self._checkMapViews(srcName)
         self._ts_src = self.logLike.deleteSource(srcName)
         logLike0 = self.logLike.value()
 
         if tol is None:
             tol = self.tol
+        self._fitNullHypothesis(n_free_base, reoptimize, approx, tol,
+                                MaxIterations, verbosity)
+        self.logLike.syncParams()
+        logLike0 = max(self.logLike.value(), logLike0)
+        Ts_value = 2*(logLike1 - logLike0)
+        self.logLike.addSource(self._ts_src)
+        self.logLike.setFreeParamValues(freeParams)
+        # Move call to saved_state.restore() here
+        # to avoid issue with EblAtten spectral model, which is nested 
+        # around other spectral models
+        saved_state.restore()
+        self.model.insert_source(srcName)
+        self.logLike.value()
+        return Ts_value
+    def TsAll(self, srcNames=None, reoptimize=False, approx=True,
+              tol=None, MaxIterations=10, verbosity=0):
+
+        '''Computes the TS values for all of the sources listed in
+        "srcNames" (default is every source in the model) and returns
+        them as an array in the same order.  Unlike calling Ts for
+        each source, the parameter state is saved and the baseline
+        likelihood is evaluated only once, and the null hypothesis for
+        each source is formed by setting its normalization to zero
+        rather than by removing it from the model.  The other options
+        have the same meaning as for Ts.'''
+
+        if srcNames is None:
+            srcNames = self.sourceNames()
+        if tol is None:
+            tol = self.tol
+        saved_state = LikelihoodState(self, compact=True)
+        self.logLike.syncParams()
+        logLike1 = self.logLike.value()
+        n_free_test = self.nFreeParams()
+        ts_values = num.zeros(len(srcNames))
+        for i, srcName in enumerate(srcNames):
+            if verbosity > 0:
+                print ("*** Ts for %s ***" % srcName)
+            self._ts_src = self.logLike.getSource(srcName)
+            srcPars = self.freePars(srcName)
+            n_free_base = n_free_test - len(srcPars)
+            # Zero the normalization and freeze the remaining source
+            # parameters, which are undetermined in the null hypothesis.
+            self.setFreeFlag(srcName, srcPars, False)
+            normPar = self.normPar(srcName)
+            normPar.setBounds(0, normPar.getBounds()[1])
+            normPar.setValue(0)
+            self.logLike.syncSrcParams(srcName)
+            logLike0 = self.logLike.value()
+            self._fitNullHypothesis(n_free_base, reoptimize, approx, tol,
+                                    MaxIterations, verbosity)
+            self.logLike.syncParams()
+            logLike0 = max(self.logLike.value(), logLike0)
+            ts_values[i] = 2*(logLike1 - logLike0)
+            saved_state.restore()
+        self.logLike.value()
+        return ts_values
+    def _fitNullHypothesis(self, n_free_base, reoptimize, approx, tol,
+                           MaxIterations=10, verbosity=0):
         if reoptimize and n_free_base > 0:
             if verbosity > 0:
                 print ("** Do reoptimize")
@@ -269,20 +317,6 @@ class AnalysisBase(object):
                     self._renorm()
                 except ZeroDivisionError:
                     pass
-        self.logLike.syncParams()
-        logLike0 = max(self.logLike.value(), logLike0)
-        Ts_value = 2*(logLike1 - logLike0)
-        self.logLike.addSource(self._ts_src)
-        self.logLike.setFreeParamValues(freeParams)
-        # Move call to saved_state.restore() here
-        # to avoid issue with EblAtten spectral model, which is nested 
-        # around other spectral models
-        saved_state.restore()
-        self.model = SourceModel(self.logLike)
-        for src in source_attributes:
-            self.model[src].__dict__.update(source_attributes[src])        
-        self.logLike.value()
-        return Ts_value
     def Ts_old(self, srcName, reoptimize=False, approx=True, tol=None):
 
         '''NOTE: this is the old method. Computes the TS value for a
@@ -292,12 +326,12 @@ class AnalysisBase(object):
         overall fit).  If "appox=True" is selected (the default) it
         will renormalize the model (see _renorm).'''
         
-        source_attributes = self.getExtraSourceAttributes()
         self.logLike.syncParams()
         src = self.logLike.getSource(srcName)
         freeParams = pyLike.DoubleVector()
         self.logLike.getFreeParamValues(freeParams)
         logLike1 = self.logLike.value()
+        self._checkMapViews(srcName)
         self._ts_src = self.logLike.deleteSource(srcName)
         logLike0 = self.logLike.value()
         if tol is None:
@@ -317,12 +351,7 @@ class AnalysisBase(object):
         Ts_value = 2*(logLike1 - logLike0)
         self.logLike.addSource(self._ts_src)
         self.logLike.setFreeParamValues(freeParams)
-        self.model = SourceModel(self.logLike)
-        #
-        # reset the extra source attributes, if any
-        #
-        for src in source_attributes:
-            self.model[src].__dict__.update(source_attributes[src])
+        self.model.insert_source(srcName)
         return Ts_value
     def flux(self, srcName, emin=100, emax=3e5, energyFlux=False):
 
@@ -341,6 +370,58 @@ class AnalysisBase(object):
         "srcName" bewtween emin and emax (in MeV).'''
 
         return self.flux(srcName, emin, emax, True)
+    def fluxTable(self, bands=((100, 3e5),), srcNames=None, npts=100,
+                  rtol=1e-4):
+
+        '''Returns a structured array with one row per source in
+        "srcNames" (default all), with fields "name", "flux" and
+        "eflux".  The last two hold the photon flux and the energy flux
+        (in MeV/cm^2/s, as returned by energyFlux) in each of the
+        (emin, emax) energy bands in "bands", all computed with "npts"
+        energies per band.  The spectra of point sources are evaluated
+        in one call per source on log-spaced grids shared by all
+        sources and integrated with the trapezoidal rule of
+        Source::flux; other sources use Source::flux and energyFlux.
+        The first point source is checked against Source::flux and
+        energyFlux, and if they differ by more than "rtol", every row
+        is computed with them instead.'''
+
+        if srcNames is None:
+            srcNames = self.sourceNames()
+        grids, weights = _bandGrids(bands, npts)
+        name_len = max([len(name) for name in srcNames] + [1])
+        table = num.zeros(len(srcNames),
+                          dtype=[('name', 'U%i' % name_len),
+                                 ('flux', float, (len(grids),)),
+                                 ('eflux', float, (len(grids),))])
+        table['name'] = srcNames
+        pointSources = [self[srcName].src.getType() == 'Point'
+                        for srcName in srcNames]
+        if True in pointSources:
+            srcName = srcNames[pointSources.index(True)]
+            if not num.allclose(self._bandFluxes(srcName, grids, weights),
+                                self._sourceFluxes(srcName, bands, npts),
+                                rtol=rtol, atol=0):
+                sys.stderr.write("Warning: fluxTable quadrature does not " +
+                                 "match Source::flux; using it for all " +
+                                 "sources.\n")
+                pointSources = [False]*len(srcNames)
+        for i, srcName in enumerate(srcNames):
+            if pointSources[i]:
+                fluxes = self._bandFluxes(srcName, grids, weights)
+            else:
+                fluxes = self._sourceFluxes(srcName, bands, npts)
+            table['flux'][i], table['eflux'][i] = fluxes
+        return table
+    def _bandFluxes(self, srcName, grids, weights):
+        dnde = spectrumValues(self[srcName].src.spectrum(), grids)
+        return num.array([_bandIntegrals(dnde, grids, weights),
+                          _bandIntegrals(dnde, grids, weights, True)])
+    def _sourceFluxes(self, srcName, bands, npts):
+        src = self[srcName]
+        return num.array([[src.flux(emin, emax, npts) for emin, emax in bands],
+                          [src.energyFlux(emin, emax, npts)
+                           for emin, emax in bands]])
     def energyFluxError(self, srcName, emin=100, emax=3e5, npts=1000):
 
         '''Returns the error on the differential flux for a source
@@ -357,47 +438,85 @@ class AnalysisBase(object):
         "energyFlux=False" it returns the integral flux; if True it
         will return the differential flux.'''
         
-        par_index_map = {}
-        indx = 0
-        for src in self.sourceNames():
-            parNames = pyLike.StringVector()
-            self[src].src.spectrum().getFreeParamNames(parNames)
-            for par in parNames:
-                par_index_map["::".join((src, par))] = indx
-                indx += 1
-        #
-        # Build the source-specific covariance matrix.
-        #
+        fluxes, errors = self.fluxErrors([srcName], ((emin, emax),),
+                                         energyFlux, npts)
+        return errors[0][0]
+    def fluxErrors(self, srcNames=None, ebands=((100, 3e5),),
+                   energyFlux=False, npts=1000):
+
+        '''Returns arrays of fluxes and their errors, of shape
+        (len(srcNames), len(ebands)), for the sources in "srcNames"
+        (default all) in each of the (emin, emax) energy bands in
+        "ebands".  If "energyFlux=True", energy fluxes are returned.
+        For point sources, the spectrum and its derivatives with
+        respect to the free parameters are evaluated in one call per
+        source on log-spaced grids of "npts" energies per band, and the
+        flux Jacobian of all bands is contracted with the covariance
+        block of the source.  Other sources use flux and fluxDeriv.'''
+
+        if srcNames is None:
+            srcNames = self.sourceNames()
+        view = self.covarianceView()
+        grids, weights = _bandGrids(ebands, npts)
+        fluxes = num.zeros((len(srcNames), len(ebands)))
+        errors = num.zeros((len(srcNames), len(ebands)))
+        for i, srcName in enumerate(srcNames):
+            srcpars = view.parNames(srcName)
+            if self[srcName].src.getType() != 'Point':
+                for j, (emin, emax) in enumerate(ebands):
+                    fluxes[i][j] = self.flux(srcName, emin, emax, energyFlux)
+                    if len(srcpars) == 0:
+                        continue
+                    partials = self._fluxPartials(srcName, srcpars, emin,
+                                                  emax, energyFlux, npts)
+                    errors[i][j] = num.sqrt(num.dot(partials,
+                                                    num.dot(view.block(srcName),
+                                                            partials)))
+                continue
+            spectrum = self[srcName].src.spectrum()
+            fluxes[i] = _bandIntegrals(spectrumValues(spectrum, grids),
+                                       grids, weights, energyFlux)
+            if len(srcpars) == 0:
+                # All parameters are fixed so the errors are zero
+                continue
+            derivs = spectrumDerivs(spectrum, grids.ravel(), srcpars)
+            jacobian = _bandIntegrals(derivs.reshape((len(srcpars),)
+                                                     + grids.shape),
+                                      grids, weights, energyFlux)
+            errors[i] = num.sqrt(num.einsum('ib,ij,jb->b', jacobian,
+                                            view.block(srcName), jacobian))
+        return fluxes, errors
+    def covarianceView(self):
+
+        '''Returns a CovarianceView of the covariance matrix from the
+        most recent fit with covar=True.  The view is rebuilt when the
+        covariance matrix, the sources or the set of free parameters
+        change.'''
+
         if self.covariance is None:
             raise RuntimeError("Covariance matrix has not been computed.")
         if not self.covar_is_current:
             sys.stderr.write("Warning: covariance matrix has not been " +
                              "updated in the most recent fit.\n")
-        covar = num.array(self.covariance)
-        if len(covar) != len(par_index_map):
+        freeFlags = tuple(par.isFree() for par in self.params())
+        signature = (self.sourceNames(), freeFlags)
+        view = getattr(self, '_covarianceView', None)
+        if (view is None or view.covariance is not self.covariance or
+            view.signature != signature):
+            view = CovarianceView(self)
+            view.signature = signature
+            self._covarianceView = view
+        if len(view.covar) != sum(freeFlags):
             raise RuntimeError("Covariance matrix size does not match the " +
                                "number of free parameters.")
-        my_covar = []
-        srcpars = pyLike.StringVector()
-        self[srcName].src.spectrum().getFreeParamNames(srcpars)
-        pars = ["::".join((srcName, x)) for x in srcpars]
-        if len(pars) == 0:
-            # All parameters are fixed so return zero
-            return 0
-        for xpar in pars:
-            ix = par_index_map[xpar]
-            my_covar.append([covar[ix][par_index_map[ypar]] for ypar in pars])
-        my_covar = num.array(my_covar)
-
+        return view
+    def _fluxPartials(self, srcName, srcpars, emin, emax, energyFlux, npts):
         if energyFlux:
-            partials = num.array([self[srcName].energyFluxDeriv(x, emin,
-                                                                emax, npts) 
-                                  for x in srcpars])
-        else:
-            partials = num.array([self[srcName].fluxDeriv(x, emin, emax, npts) 
-                                  for x in srcpars])
-
-        return num.sqrt(num.dot(partials, num.dot(my_covar, partials)))
+            return num.array([self[srcName].energyFluxDeriv(x, emin, emax,
+                                                            npts)
+                              for x in srcpars])
+        return num.array([self[srcName].fluxDeriv(x, emin, emax, npts)
+                          for x in srcpars])
     def setSpectrum(self, srcName, functionName):
 
         '''Set the spectral shape of a source identified by "srcName".
@@ -408,21 +527,24 @@ class AnalysisBase(object):
         new model will be set to defaults which are probably not what
         you want them to be.'''
         
-        source_attributes = self.getExtraSourceAttributes()
         src = self.logLike.getSource(srcName)
         src.setSpectrum(functionName)
         self.syncSrcParams(srcName)
-        self._setSourceAttributes(source_attributes)
+        self.model.insert_source(srcName)
     def deleteSource(self, srcName):
 
         '''Removes a source with name "srcName" from the model.  It
         returns this source object so you can save it and use it
         later.'''
         
-        source_attributes = self.getExtraSourceAttributes()
+        self._checkMapViews(srcName)
         src = self.logLike.deleteSource(srcName)
-        self._setSourceAttributes(source_attributes)
+        self.model.remove_source(srcName)
         return src
+    def _checkMapViews(self, srcName):
+        """Called before the source map of srcName is deleted; raises if
+        views of it are still in use (see BinnedAnalysis.modelMapView)."""
+        pass
     def addSource(self, src):
 
         '''Add a source to the active model.  You should pass a source
@@ -447,23 +569,22 @@ class AnalysisBase(object):
         fully formed source object and modify the parameters of that.
         '''
         
-        source_attributes = self.getExtraSourceAttributes()
         self.logLike.addSource(src)
-        self._setSourceAttributes(source_attributes)
+        self.model.insert_source(src.getName())
     def mergeSources(self,compName,sourceNames,specFuncName):
         '''Merge a set of sources into a single composite source'''
         sv = pyLike.StringVector()
         for sn in sourceNames:
             sv.push_back(sn)
-        source_attributes = self.getExtraSourceAttributes()
         comp = self.logLike.mergeSources(compName,sv,specFuncName)                
-        self._setSourceAttributes(source_attributes)
+        self.model.update()
         return comp
     def splitCompositeSource(self,compName):
         '''break apart a composite source and return a tuple with 
         the names of new sources and the spectral function'''
         sv = pyLike.StringVector()
         specFunc = self.logLike.splitCompositeSource(compName,sv)
+        self.model.update()
         l = [sv[i] for i in range(sv.size())]
         return (l,specFunc)
     def _setSourceAttributes(self, source_attributes):
@@ -556,10 +677,10 @@ class AnalysisBase(object):
         likelihood values.'''
         
         if src is not None:
-            self.logLike.syncSrcParams(src)
+            self.model.syncSrcParams(src)
         else:
             for src in self.sourceNames():
-                self.logLike.syncSrcParams(src)
+                self.model.syncSrcParams(src)
     def sourceNames(self):
         '''Returns a tuple that contains all of the source names in the model'''
         srcNames = pyLike.StringVector()
@@ -684,7 +805,7 @@ class AnalysisBase(object):
         return self.model[name]
     def __setitem__(self, name, value):
         self.model[name] = value
-        self.logLike.syncSrcParams(self.model[name].srcName)
+        self.model.syncSrcParams(self.model[name].srcName)
     def normPar(self, srcName):
 
         '''Returns the normalization paramter of a souce specified by
@@ -762,7 +883,8 @@ class AnalysisBase(object):
         self.srcModel = xmlFile
     def scan(self, srcName, parName, xmin=0, xmax=10, npts=50,
              tol=None, optimizer=None, optObject=None,
-             fix_src_pars=False, verbosity=0, renorm=False):
+             fix_src_pars=False, verbosity=0, renorm=False, cache=None,
+             profile=True):
 
         '''This function scans the values of a specific parameter
         specified by "parName" of a specific source specified by
@@ -772,14 +894,25 @@ class AnalysisBase(object):
         the second is an array of the change in likelihood value from
         the original model at those x values.  You can also pass True
         to "fix_src_pars" to fix all of the parameters of the source
-        of interest.  The other options are similar to the fit and
-        optimize functions. '''
+        of interest.  The points are visited outward from the current
+        (best-fit) value in both directions, and each one is optimized
+        starting from the nuisance parameters of the nearest points
+        already found, which are kept in "cache", a ProfileCache that
+        may be shared with the upper limit calculations.  With
+        profile=False the other parameters are left at their current
+        values; if the scanned parameter is the normalization of the
+        source in a binned analysis, all of the points are then
+        computed in one pass over the model counts, which are linear
+        in it.  The other options are similar to the fit and optimize
+        functions. '''
         
-        saved_state = LikelihoodState(self)
+        saved_state = LikelihoodState(self, compact=True)
+        if cache is None:
+            cache = ProfileCache()
         indx = self.par_index(srcName,parName)
         # Fix the normalization parameter for the scan.
-        bounds = self.model[indx].getBounds()
-        self.model[indx].setBounds(xmin,xmax)
+        bounds = self[indx].getBounds()
+        self[indx].setBounds(xmin, xmax)
         self.freeze(indx)
         logLike0 = self.__call__()
         #need to check that all parameters are not frozen, else the call
@@ -798,23 +931,117 @@ class AnalysisBase(object):
 
         if tol is None:
             tol = self.tol
-        # Scan over the range of interest
-        xvals, dlogLike = [], []
-        for i, x in enumerate(num.linspace(xmin, xmax, npts)):
-            xvals.append(x)
-            self.model[indx] = x
-            self.syncSrcParams(srcName)
-            if not allFrozen :
-                self.optimize(verbosity, tol, optimizer, optObject)
-            dlogLike.append(self.__call__() - logLike0)
-            if verbosity > 1:
-                print (i, x, dlogLike[-1])
+        xvals = num.linspace(xmin, xmax, npts)
+        if profile and not allFrozen:
+            cache.store(self, srcName, parName, self[indx].getValue())
+            dlogLike = self._profileScan(srcName, parName, xvals, logLike0,
+                                         cache, verbosity, tol, optimizer,
+                                         optObject)
+        else:
+            dlogLike = self._fixedScan(srcName, parName, xvals) - logLike0
 
         # Restore model parameters to original values
         saved_state.restore()
-        self.model[indx].setBounds(bounds)
-
-        return num.array(xvals), num.array(dlogLike)
+        self[indx].setBounds(*bounds)
+
+        return xvals, dlogLike
+
+    def _profileScan(self, srcName, parName, xvals, logLike0, cache,
+                     verbosity, tol, optimizer, optObject):
+        indx = self.par_index(srcName, parName)
+        x0 = self[indx].getValue()
+        above = [i for i, x in enumerate(xvals) if x >= x0]
+        below = [i for i, x in enumerate(xvals) if x < x0]
+        dlogLike = num.zeros(len(xvals))
+        for i in above + below[::-1]:
+            x = xvals[i]
+            self[indx] = x
+            if cache.restore(self, srcName, parName, x) is None:
+                cache.guess(self, srcName, parName, x)
+                # SummedLikelihood.optimize does not take optObject.
+                if optObject is None:
+                    self.optimize(verbosity=verbosity, tol=tol,
+                                  optimizer=optimizer)
+                else:
+                    self.optimize(verbosity=verbosity, tol=tol,
+                                  optimizer=optimizer, optObject=optObject)
+                cache.store(self, srcName, parName, x)
+            dlogLike[i] = self.__call__() - logLike0
+            if verbosity > 1:
+                print (i, x, dlogLike[i])
+        return dlogLike
+
+    def _fixedScan(self, srcName, parName, xvals):
+        '''-log-likelihood at each of the values xvals of the
+        parameter, with all of the other parameters fixed.'''
+        negLogLike = None
+        if (parName == self.normPar(srcName).getName() and
+            all(hasattr(comp, '_normScanTerms')
+                for comp in self._scanComponents())):
+            try:
+                negLogLike = self._linearNormScan(srcName, parName, xvals)
+            except RuntimeError:
+                negLogLike = None
+        if negLogLike is None:
+            indx = self.par_index(srcName, parName)
+            negLogLike = num.zeros(len(xvals))
+            for i, x in enumerate(xvals):
+                self[indx] = x
+                negLogLike[i] = self.__call__()
+        return negLogLike
+
+    def _scanComponents(self):
+        return [self]
+
+    def _linearNormScan(self, srcName, parName, xvals, chunksize=10000000):
+        '''-log-likelihood at each of the values xvals of the
+        normalization parameter of srcName, from the counts, the total
+        model counts and the model counts of srcName in each pixel of
+        the (binned) components at a reference value xref:
+
+        -logL(x) = -logL(xref) + c*Npred - sum(n*log(1 + c*m_src/m)),
+        c = (x - xref)/xref.
+
+        Returns None if the result does not reproduce a direct
+        evaluation at the point farthest from xref, e.g., if the
+        likelihood is weighted, energy dispersion is applied or the
+        parameter has a prior, or if x0 = 0 and none of the nonzero
+        xvals lies within the parameter bounds.'''
+        indx = self.par_index(srcName, parName)
+        x0 = self[indx].getValue()
+        xref = x0
+        if xref == 0:
+            xmin, xmax = self[indx].getBounds()
+            inside = [x for x in xvals if x != 0 and xmin <= x <= xmax]
+            if not inside:
+                return None
+            xref = max(inside, key=abs)
+            self[indx] = xref
+        try:
+            negLogLikeRef = self.__call__()
+            terms = [comp._normScanTerms(srcName)
+                     for comp in self._scanComponents()]
+            k = num.argmax(abs(xvals - xref))
+            self[indx] = xvals[k]
+            negLogLikeTest = self.__call__()
+        finally:
+            self[indx] = x0
+        coeffs = (xvals - xref)/xref
+        negLogLike = negLogLikeRef + coeffs*sum(term[3] for term in terms)
+        with num.errstate(divide='ignore', invalid='ignore'):
+            for counts, model, srcCounts, npred in terms:
+                ratio = srcCounts/model
+                nchunk = max(chunksize//max(len(counts), 1), 1)
+                for i in range(0, len(coeffs), nchunk):
+                    c = coeffs[i:i+nchunk, None]
+                    negLogLike[i:i+nchunk] -= num.sum(
+                        counts*num.log1p(c*ratio), axis=1)
+        test = negLogLike[k]
+        if (not num.isfinite(test) or abs(test - negLogLikeTest)
+            > 1e-3 + 1e-6*abs(negLogLikeTest)):
+            return None
+        negLogLike[~num.isfinite(negLogLike)] = num.inf
+        return negLogLike
 
     def addPrior(self, srcName, parName, funcname, **kwds):
         self.model.addPrior(srcName, parName, funcname, **kwds)
@@ -863,6 +1090,7 @@ class AnalysisBase(object):
         self.logLike.syncParams()
 
     def writePriorsYaml(self, filename):
+        import yaml
         self.logLike.syncParams()
         prior_dict = self.model.getPriors()
         if filename is None:
@@ -874,11 +1102,28 @@ class AnalysisBase(object):
             fout.close()
 
     def readPriorsYaml(self, filename):
+        import yaml
         prior_dict = yaml.load(open(filename))
         self.model.addPriors(prior_dict)
         self.logLike.syncParams()
 
 
+def _bandGrids(bands, npts):
+    """Log-spaced grids of npts energies for each (emin, emax) band, as
+    used by the trapezoidal quadrature of Source::flux, and the
+    half-widths of their intervals."""
+    grids = num.array([num.logspace(num.log10(emin), num.log10(emax), npts)
+                       for emin, emax in bands])
+    return grids, num.diff(grids, axis=1)/2.
+
+def _bandIntegrals(values, grids, weights, energyFlux=False):
+    """Trapezoidal integrals over the last axis of values, evaluated on
+    grids; with energyFlux=True the values are first multiplied by
+    the energies."""
+    if energyFlux:
+        values = values*grids
+    return num.sum(weights*(values[..., 1:] + values[..., :-1]), axis=-1)
+
 def _quotefn(filename):
     if filename is None:
         return None
@@ -9,17 +9,44 @@ Python interface for binned likelihood.
 
 import os
 import sys
-import bisect
+import time
 import pyLikelihood as pyLike
-from SrcModel import SourceModel
+from SrcModel import SourceModel, funcFactory
 from AnalysisBase import AnalysisBase, _quotefn, _null_file, num
 try:
     from tkinter.simpledialog import SimpleDialog, map, Param
 except ImportError:
     pass
 
-_funcFactory = pyLike.SourceFactory.funcFactory()
+_shared_obs = None
+_shared_func = None
+_shared_startup = None
 
+def _init_shared_worker(obs, func, t0):
+    global _shared_obs, _shared_func, _shared_startup
+    _shared_obs = obs
+    _shared_func = func
+    _shared_startup = time.time() - t0
+
+def _call_shared(task):
+    return os.getpid(), _shared_startup, _shared_func(_shared_obs, task)
+
+def _floatView(owner, address, shape, refs=None):
+    """Read-only numpy view of the floats at address, which keeps a
+    reference to the object owning them.  This keeps the owner alive,
+    but not memory that the owner itself frees.  If the list "refs" is
+    given, a weak reference to the underlying buffer, which stays alive
+    as long as the view or any array derived from it, is appended."""
+    import ctypes
+    import weakref
+    size = int(num.prod(shape))
+    buffer = (ctypes.c_float*size).from_address(address)
+    buffer.owner = owner
+    if refs is not None:
+        refs.append(weakref.ref(buffer))
+    view = num.ctypeslib.as_array(buffer).reshape(shape)
+    view.flags.writeable = False
+    return view
 
 def BinnedConfig(**kwargs):
     """
@@ -47,6 +74,7 @@ def BinnedConfig(**kwargs):
 class BinnedObs(object):
     def __init__(self, srcMaps=None, expCube=None, binnedExpMap=None,
                  irfs=None, phased_expmap=None):
+        t0 = time.time()
         if srcMaps is None or expCube is None:
             srcMaps, expCube, binnedExpMap, irfs = self._obsDialog(srcMaps,
                                                                    expCube)
@@ -70,6 +98,32 @@ class BinnedObs(object):
         # EAC switch to using AppHelpers...
         self.countsMap = pyLike.AppHelpers.readCountsMap(srcMaps)
         self._createObservation(srcMaps, expCube, self.irfs)
+        self.creationTime = time.time() - t0
+        self.workerStartup = {}
+    def map(self, func, tasks, n_workers=None):
+        """Return [func(self, task) for task in tasks], evaluated in a
+        pool of forked worker processes.  The workers use this object,
+        inherited from the parent process, so the counts map, exposure
+        cube, binned exposure and mean PSF are not rebuilt; func should
+        only read from it, e.g., to build a BinnedAnalysis.  func is not
+        pickled, but the tasks and results are.  The startup time of
+        each worker, keyed by process id, is kept in workerStartup for
+        comparison with creationTime, the time taken to build this
+        object."""
+        import multiprocessing
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        context = multiprocessing.get_context('fork')
+        pool = context.Pool(n_workers, _init_shared_worker,
+                            (self, func, time.time()))
+        try:
+            output = pool.map(_call_shared, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        self.workerStartup = dict((pid, startup)
+                                  for pid, startup, result in output)
+        return [result for pid, startup, result in output]
     def _createObservation(self, srcMaps, expCube, irfs):
         self._respFuncs = pyLike.ResponseFunctions()
         self._respFuncs.load_with_event_types(irfs, "", self.srcMaps, "")
@@ -156,6 +210,7 @@ class BinnedAnalysis(AnalysisBase):
         self.binnedData = binnedData
         self.srcModel = srcModel
         self.optimizer = optimizer
+        self.wmapFile = wmap
         if wmap and wmap != "none":
             self.wmap = pyLike.WcsMapLibrary.instance().wcsmap(wmap,"")
             self.wmap.setInterpolation(False)
@@ -170,6 +225,7 @@ class BinnedAnalysis(AnalysisBase):
             config = BinnedConfig(applyPsfCorrections=psfcorr,
                                   delete_local_fixed=delete_local_fixed,
                                   no_cached_weightmaps=no_cached_weightmaps)
+        self.config = config
 
         self.logLike = pyLike.BinnedLikelihood(binnedData.countsMap,
                                                binnedData.observation,
@@ -179,7 +235,8 @@ class BinnedAnalysis(AnalysisBase):
 
         self.verbosity = verbosity
         self.logLike.initOutputStreams()
-        self.logLike.readXml(srcModel, _funcFactory, False, True, False)
+        self.logLike.readXml(srcModel, funcFactory(verbosity), False, True,
+                             False)
         self.model = SourceModel(self.logLike, srcModel)
         self.energies = num.array(self.logLike.energies())
         self.e_vals = num.sqrt(self.energies[:-1]*self.energies[1:])
@@ -187,10 +244,66 @@ class BinnedAnalysis(AnalysisBase):
         self.nobs_wt = self.logLike.countsSpectrum(True)
         self.sourceFitPlots = []
         self.sourceFitResids  = []
+        self._mapViews = {}
     def _inputs(self):
         return '\n'.join((str(self.binnedData),
                           'Source model file: ' + str(self.srcModel),
                           'Optimizer: ' + str(self.optimizer)))
+    def _mapShape(self):
+        return (len(self.energies) - 1,
+                self.logLike.countsMap().pixels().size())
+    def countsMapView(self):
+        """The counts cube as a read-only numpy view of shape (nebins,
+        npix), without copying."""
+        return _floatView(self.logLike, self.logLike.countsMapAddress(),
+                          self._mapShape())
+    def modelMapView(self, srcName):
+        """Read-only view of the in-memory model map of srcName, of
+        shape (nebins + 1, npix), i.e., evaluated at the energy bin edges.
+        The memory belongs to the source map, so the view is invalid
+        once that map is deleted or rebuilt.  To guard against this,
+        deleteSource and Ts raise a RuntimeError while a view of the
+        source's map (or of any array derived from it) is still
+        referenced; other calls that rebuild source maps through
+        logLike directly are not checked."""
+        nebins, npix = self._mapShape()
+        if self.logLike.sourceMapSize(srcName) != (nebins + 1)*npix:
+            raise RuntimeError("Source map for %s is not in memory or "
+                               "does not match the counts map." % srcName)
+        return _floatView(self.logLike, self.logLike.sourceMapAddress(srcName),
+                          (nebins + 1, npix),
+                          self._mapViews.setdefault(srcName, []))
+    def _checkMapViews(self, srcName):
+        views = self._mapViews.get(srcName, [])
+        if views:
+            # Views in reference cycles are only freed by the collector.
+            import gc
+            gc.collect()
+            views = [ref for ref in views if ref() is not None]
+            self._mapViews[srcName] = views
+        if views:
+            raise RuntimeError("Views of the source map of %s returned by "
+                               "modelMapView are still in use; delete them "
+                               "(or copy them) first." % srcName)
+    def modelCountsArray(self, srcName):
+        """Model counts of srcName in each pixel with nonzero counts, as a
+        numpy array of shape (nebins, npix)."""
+        model_counts = num.empty(self._mapShape())
+        self.logLike.fillModelCounts(srcName, model_counts.ctypes.data)
+        return model_counts
+    def _normScanTerms(self, srcName):
+        """Counts, total model counts and model counts of srcName in the
+        pixels with nonzero counts, and the Npred of srcName, for
+        AnalysisBase._linearNormScan."""
+        counts = self.countsMapView()
+        mask = counts > 0
+        model = num.zeros(counts.shape)
+        for name in self.sourceNames():
+            model_counts = self.modelCountsArray(name)
+            model += model_counts
+            if name == srcName:
+                srcCounts = model_counts[mask]
+        return counts[mask], model[mask], srcCounts, self.NpredValue(srcName)
     def _srcCnts(self, srcName, weighted=False):
         cnts = num.array(self.logLike.modelCountsSpectrum(srcName, weighted))
         return cnts
@@ -211,10 +324,10 @@ class BinnedAnalysis(AnalysisBase):
         self.model[name] = value
         self.logLike.syncParams()
     def addSource(self, src, binnedConfig=None):
-        source_attributes = self.getExtraSourceAttributes()
         self.logLike.addSource(src,binnedConfig)
-        self._setSourceAttributes(source_attributes)
+        self.model.insert_source(src.getName())
     def setEnergyRange(self, emin, emax):
+        import bisect
         kmin = bisect.bisect(self.energies, emin) - 1
         kmax = min(bisect.bisect_left(self.energies, emax),
                    len(self.energies)-1)
@@ -9,7 +9,6 @@ more natural symantics for use in python alongside other analysis classes.
 #
 
 import pyLikelihood as pyLike
-from SrcModel import SourceModel
 
 class Composite2(object):
     def __init__(self, optimizer='Minuit'):
@@ -88,8 +87,6 @@ class Composite2(object):
     def _set_errors(self, errors):
         my_errors = list(errors)
         self.composite.setErrors(my_errors)
-        for component in self.components:
-            component.model = SourceModel(component.logLike)
     def __getattr__(self, attrname):
         return getattr(self.composite, attrname)
     def __repr__(self):
@@ -0,0 +1,44 @@
+"""
+@brief Access to the blocks of a fit covariance matrix belonging to
+individual sources.
+"""
+# $Header$
+
+import numpy as num
+import pyLikelihood as pyLike
+
+class CovarianceView(object):
+    """Index of the free spectral parameters of each source in the
+    covariance matrix of "like", built once for a given covariance
+    matrix.  The parameters of each source occupy a contiguous range of
+    rows in the order of like.sourceNames()."""
+    def __init__(self, like):
+        if like.covariance is None:
+            raise RuntimeError("Covariance matrix has not been computed.")
+        self.covariance = like.covariance
+        self.covar = num.array(like.covariance)
+        self._parNames = {}
+        self._indices = {}
+        indx = 0
+        for src in like.sourceNames():
+            parNames = pyLike.StringVector()
+            like[src].src.spectrum().getFreeParamNames(parNames)
+            self._parNames[src] = tuple(parNames)
+            self._indices[src] = num.arange(indx, indx + len(parNames))
+            indx += len(parNames)
+        if len(self.covar) != indx:
+            raise RuntimeError("Covariance matrix size does not match the " +
+                               "number of free parameters.")
+    def parNames(self, srcName):
+        "Names of the free spectral parameters of srcName."
+        return self._parNames[srcName]
+    def indices(self, srcName):
+        "Rows of the covariance matrix for the parameters of srcName."
+        return self._indices[srcName]
+    def block(self, srcName, otherName=None):
+        """Covariance of the parameters of srcName with those of
+        otherName (default srcName)."""
+        if otherName is None:
+            otherName = srcName
+        return self.covar[num.ix_(self._indices[srcName],
+                                  self._indices[otherName])]
@@ -0,0 +1,542 @@
+"""
+@brief Joint likelihood of analysis objects that live in separate
+worker processes, on this host or on others.
+"""
+# $Header$
+
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+import pyLikelihood as pyLike
+
+def _attribute(like, name):
+    obj = like
+    for item in name.split('.'):
+        obj = getattr(obj, item)
+    return obj
+
+def _parameters(like):
+    """Name, value, bounds, scale and free flag of each parameter of the
+    logLike object, in the order of its parameter vectors."""
+    like.logLike.syncParams()
+    pars = pyLike.ParameterVector()
+    like.logLike.getParams(pars)
+    return [(par.getName(), par.getValue()) + tuple(par.getBounds())
+            + (par.getScale(), par.isFree()) for par in pars]
+
+def _freeParamValues(like):
+    like.logLike.syncParams()
+    values = pyLike.DoubleVector()
+    like.logLike.getFreeParamValues(values)
+    return list(values)
+
+def _freeIndices(like):
+    "Model indices of the free parameters."
+    return [indx for indx, par in enumerate(like.params()) if par.isFree()]
+
+def _setFreeParamValues(like, x):
+    if x is not None:
+        like.logLike.setFreeParamValues(list(x))
+
+def _value(like, x=None):
+    _setFreeParamValues(like, x)
+    return like.logLike.value()
+
+def _derivs(like, x=None):
+    _setFreeParamValues(like, x)
+    derivs = pyLike.DoubleVector()
+    like.logLike.getFreeDerivs(derivs)
+    return list(derivs)
+
+def _param(like, indx, method, args=()):
+    "Call a method of the indx'th model parameter."
+    result = getattr(like.params()[indx], method)(*args)
+    like.logLike.syncParams()
+    return result
+
+def _normParIndex(like, srcName):
+    return like.par_index(srcName, like.normPar(srcName).getName())
+
+def _renormInfo(like):
+    """Npred of each source, whether its normalization is free and
+    whether it is diffuse or near the source removed by Ts."""
+    return [(src, like.NpredValue(src), like.normPar(src).isFree(),
+             like.isDiffuseOrNearby(src)) for src in like.sourceNames()]
+
+def _removeSource(like, removed, srcName):
+    like._checkMapViews(srcName)
+    removed[srcName] = like.logLike.deleteSource(srcName)
+    like._ts_src = removed[srcName]
+
+def _restoreSource(like, removed, srcName):
+    like.logLike.addSource(removed.pop(srcName))
+    like.model.insert_source(srcName)
+
+def _call(like, name, args=(), kwds=None):
+    if kwds is None:
+        kwds = {}
+    return _attribute(like, name)(*args, **kwds)
+
+_commands = {'parameters': _parameters,
+             'freeParamValues': _freeParamValues,
+             'freeIndices': _freeIndices,
+             'value': _value,
+             'derivs': _derivs,
+             'setFreeParamValues': _setFreeParamValues,
+             'nParams': lambda like: len(like.params()),
+             'param': _param,
+             'normParIndex': _normParIndex,
+             'renormInfo': _renormInfo,
+             'call': _call}
+
+# Commands that also need the worker's sources removed by Ts.
+_sourceCommands = {'removeSource': _removeSource,
+                   'restoreSource': _restoreSource}
+
+def _runWorker(like, conn):
+    """Build the component if "like" is a factory function, then answer
+    requests on "conn" until it is closed.  Every request gets a reply
+    of ('ok', result) or ('error', message), starting with one for the
+    construction of the component."""
+    try:
+        if not hasattr(like, 'logLike'):
+            like = like()
+    except Exception as message:
+        conn.send(('error', 'Component construction failed: %s' % message))
+        conn.close()
+        return
+    conn.send(('ok', None))
+    removed = {}
+    while True:
+        try:
+            command, args = conn.recv()
+        except EOFError:
+            break
+        if command == 'close':
+            break
+        try:
+            if command in _sourceCommands:
+                result = _sourceCommands[command](like, removed, *args)
+            else:
+                result = _commands[command](like, *args)
+        except Exception as message:
+            conn.send(('error', '%s: %s' % (command, message)))
+        else:
+            conn.send(('ok', result))
+    conn.close()
+
+def serveComponent(like, address, authkey=None):
+    """Serve one component to a DistributedSummedLikelihood that calls
+    connect(address, authkey).  This is run on the host holding the
+    component's data; "like" is an analysis object or a function
+    without arguments returning one, which is called after the
+    connection is made."""
+    listener = Listener(address, authkey=authkey)
+    try:
+        conn = listener.accept()
+    finally:
+        listener.close()
+    _runWorker(like, conn)
+
+class _Evaluator(object):
+    """Summed log-likelihood and free parameter derivatives of the
+    workers, called by the CallbackStatistic that the optimizers see."""
+    def __init__(self, owner):
+        self.owner = owner
+    def value(self, x):
+        return sum(self.owner._broadcast('value', x))
+    def derivs(self, x):
+        return [sum(items) for items in
+                zip(*self.owner._broadcast('derivs', x))]
+
+class Parameter(object):
+    """Parameter indx of every component's model, with the interface of
+    SummedLikelihood.Parameter.  Values are read from the first
+    component and set in all of them."""
+    def __init__(self, owner, indx):
+        self.owner = owner
+        self.indx = indx
+    def _get(self, method, *args):
+        return self.owner._request('param', self.indx, method, args)
+    def _set(self, method, *args):
+        self.owner._broadcast('param', self.indx, method, args)
+        self.owner.covar_is_current = False
+    def getName(self):
+        return self._get('getName')
+    def value(self):
+        return self._get('value')
+    def getValue(self):
+        return self._get('getValue')
+    def getScale(self):
+        return self._get('getScale')
+    def getBounds(self):
+        return self._get('getBounds')
+    def isFree(self):
+        return self._get('isFree')
+    def error(self):
+        return self._get('error')
+    def alwaysFixed(self):
+        return self._get('alwaysFixed')
+    def setFree(self, flag):
+        self._set('setFree', flag)
+    def setValue(self, value):
+        self._set('setValue', value)
+    def setTrueValue(self, value):
+        self._set('setTrueValue', value)
+    def setError(self, error):
+        self._set('setError', error)
+    def setBounds(self, minValue, maxValue):
+        self._set('setBounds', minValue, maxValue)
+    def setScale(self, scale):
+        self._set('setScale', scale)
+    def setAlwaysFixed(self, alwaysFixed):
+        self._set('setAlwaysFixed', alwaysFixed)
+
+class DistributedSummedLikelihood(object):
+    """Counterpart of SummedLikelihood whose components each live in
+    their own worker process, so that every worker holds only its own
+    component's source maps and data.  Components are started on this
+    host with addComponent or served from other hosts with
+    serveComponent and attached with connect.  Only free parameter
+    vectors, log-likelihood values and derivatives (plus small control
+    requests such as freezing a parameter) are exchanged with the
+    workers, and all of them are evaluated concurrently.
+
+    Fits use the pyLikelihood optimizers, as in SummedLikelihood, on a
+    CallbackStatistic (see statistic()) whose value and derivatives
+    are the sums over the workers, so the same optimizer settings give
+    the same fitted values and errors.
+
+    Priors are kept in the first component only, so that each one is
+    counted once in the summed log-likelihood: those found in the
+    other components when they are built are moved to the first one,
+    and addPrior and friends act on the first component.
+
+    The source objects are held by the workers, so access by source
+    name with like[srcName], adding, deleting or replacing sources,
+    saved fit states and plotting are not supported and raise a
+    RuntimeError."""
+    _unsupported = ('addSource', 'deleteSource', 'setSpectrum',
+                    'saveBestFit', 'saveCurrentFit', 'restoreBestFit',
+                    'plot', 'oplot', 'plotSource', 'setPlotter',
+                    'writeCountsSpectra')
+    def __init__(self, optimizer='Minuit', tol=1e-2):
+        self.optimizer = optimizer
+        self.tol = tol
+        self.tolType = pyLike.ABSOLUTE
+        self.covariance = None
+        self.covar_is_current = False
+        self.optObject = None
+        self.composite = None
+        self._connections = []
+        self._pending = []
+        self._processes = []
+    def __getattr__(self, name):
+        if name in DistributedSummedLikelihood._unsupported:
+            raise RuntimeError("DistributedSummedLikelihood does not support "
+                               "%s: the sources are held by the worker "
+                               "processes." % name)
+        raise AttributeError(name)
+    def addComponent(self, like):
+        """Start a worker process for a component.  "like" is either an
+        analysis object, which the worker inherits when it is forked, or
+        a function without arguments that the worker calls to build one.
+        With a function, the component's data are only ever loaded in
+        the worker."""
+        context = multiprocessing.get_context('fork')
+        conn, child_conn = context.Pipe()
+        process = context.Process(target=_runWorker, args=(like, child_conn))
+        process.daemon = True
+        process.start()
+        child_conn.close()
+        self._processes.append(process)
+        self._connections.append(conn)
+        self._pending.append(conn)
+    def connect(self, address, authkey=None):
+        """Attach a component served by serveComponent(like, address,
+        authkey) on another host."""
+        conn = Client(address, authkey=authkey)
+        self._connections.append(conn)
+        self._pending.append(conn)
+    def _receive(self, conn):
+        status, result = conn.recv()
+        if status == 'error':
+            raise RuntimeError(result)
+        return result
+    def _send(self, conn, command, *args):
+        conn.send((command, args))
+        return self._receive(conn)
+    def _wait(self):
+        """Wait until all of the components have been built, then move
+        their priors to the first component."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        errors = []
+        for conn in pending:
+            try:
+                self._receive(conn)
+            except RuntimeError as message:
+                errors.append(str(message))
+        if errors:
+            raise RuntimeError("\n".join(errors))
+        self._collectPriors()
+    def _collectPriors(self):
+        first = self._connections[0]
+        priors = self._send(first, 'call', 'getPriors')
+        missing = {}
+        for conn in self._connections[1:]:
+            for srcName, pars in self._send(conn, 'call',
+                                            'getPriors').items():
+                for parName, prior in pars.items():
+                    if parName not in priors.get(srcName, {}):
+                        priors.setdefault(srcName, {})[parName] = prior
+                        missing.setdefault(srcName, {})[parName] = prior
+            self._send(conn, 'call', 'removePriors')
+        if missing:
+            self._send(first, 'call', 'addPriors', (missing,))
+    def _broadcast(self, command, *args):
+        """Send a request to all of the workers, then collect the
+        replies, so that the workers process it concurrently."""
+        self._wait()
+        if not self._connections:
+            raise RuntimeError("No components have been added.")
+        for conn in self._connections:
+            conn.send((command, args))
+        results, errors = [], []
+        for conn in self._connections:
+            try:
+                results.append(self._receive(conn))
+            except RuntimeError as message:
+                errors.append(str(message))
+        if errors:
+            raise RuntimeError("\n".join(errors))
+        return results
+    def _request(self, command, *args):
+        "Send a request to the first component only."
+        self._wait()
+        if not self._connections:
+            raise RuntimeError("No components have been added.")
+        return self._send(self._connections[0], command, *args)
+    def _call(self, name, *args, **kwds):
+        return self._broadcast('call', name, args, kwds)
+    def close(self):
+        "Stop the workers."
+        for conn in self._connections:
+            try:
+                conn.send(('close', ()))
+                conn.close()
+            except (IOError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+        self._connections, self._pending, self._processes = [], [], []
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+    def __call__(self):
+        return -sum(self._broadcast('value'))
+    def statistic(self):
+        """The CallbackStatistic of the summed log-likelihood, with its
+        parameters set from the components.  The same object is
+        returned by every call, so an optimizer created for it may be
+        passed to fit as optObject."""
+        if self.composite is None:
+            self.composite = pyLike.CallbackStatistic(_Evaluator(self))
+        self.composite.clearParameters()
+        for par in self._request('parameters'):
+            self.composite.addParameter(*par)
+        return self.composite
+    def _setStatisticValues(self):
+        "Set the components' parameters to those of the statistic."
+        values = pyLike.DoubleVector()
+        self.composite.getFreeParamValues(values)
+        self.setFreeParamValues(list(values))
+    def freeParamValues(self):
+        return self._request('freeParamValues')
+    def setFreeParamValues(self, x):
+        self._broadcast('setFreeParamValues', list(x))
+    def fit(self, verbosity=3, tol=None, optimizer=None,
+            covar=False, optObject=None, numericDerivs=False):
+        if tol is None:
+            tol = self.tol
+        self._errors(optimizer, verbosity, tol, covar=covar,
+                     optObject=optObject, numericDerivs=numericDerivs)
+        return self()
+    def optimize(self, verbosity=3, tol=None, optimizer=None):
+        if optimizer is None:
+            optimizer = self.optimizer
+        if tol is None:
+            tol = self.tol
+        optFactory = pyLike.OptimizerFactory.instance()
+        myOpt = optFactory.create(optimizer, self.statistic())
+        try:
+            myOpt.find_min_only(verbosity, tol, self.tolType)
+        finally:
+            self._setStatisticValues()
+        self.covar_is_current = False
+    def _errors(self, optimizer=None, verbosity=0, tol=None,
+                useBase=False, covar=False, optObject=None, numericDerivs=False):
+        if optimizer is None:
+            optimizer = self.optimizer
+        if tol is None:
+            tol = self.tol
+        statistic = self.statistic()
+        if optObject is None:
+            optFactory = pyLike.OptimizerFactory.instance()
+            myOpt = optFactory.create(optimizer, statistic)
+        else:
+            myOpt = optObject
+        self.optObject = myOpt
+        if numericDerivs:
+            myOpt.setNumericDerivFlag(numericDerivs)
+        try:
+            myOpt.find_min(verbosity, tol, self.tolType)
+        finally:
+            self._setStatisticValues()
+        errors = myOpt.getUncertainty(useBase)
+        if covar:
+            self.covariance = myOpt.covarianceMatrix()
+            self.covar_is_current = True
+        else:
+            self.covar_is_current = False
+        self._call('model.setErrors', list(errors))
+        return errors
+    def minosError(self, srcname, parname, level=1):
+        if self.optObject is None:
+            raise RuntimeError("minosError needs a previous fit with the "
+                               "Minuit or NewMinuit optimizer.")
+        saved_values = self.freeParamValues()
+        par_index = self.par_index(srcname, parname)
+        try:
+            index = self._request('freeIndices').index(par_index)
+        except ValueError:
+            raise RuntimeError("Invalid parameter specification")
+        self.statistic()
+        try:
+            return self.optObject.Minos(index, level)
+        except RuntimeError as message:
+            raise RuntimeError("Minos error encountered for parameter %i: %s"
+                               % (index, message))
+        finally:
+            self.setFreeParamValues(saved_values)
+    def sourceNames(self):
+        return self._request('call', 'sourceNames')
+    def par_index(self, srcname, parname):
+        return self._request('call', 'par_index', (srcname, parname))
+    def params(self):
+        return [Parameter(self, indx)
+                for indx in range(self._request('nParams'))]
+    def normPar(self, source):
+        return Parameter(self, self._request('normParIndex', source))
+    def nFreeParams(self):
+        '''Count the number of free parameters in the active model.'''
+        return len(self._request('freeIndices'))
+    def NpredValue(self, src, weighted=False):
+        return sum(self._call('NpredValue', src, weighted))
+    def total_nobs(self, weighted=False):
+        return sum(self._call('total_nobs', weighted))
+    def __getitem__(self, name):
+        if isinstance(name, int):
+            return Parameter(self, name)
+        raise RuntimeError("DistributedSummedLikelihood parameters can only "
+                           "be accessed by index; the sources are held by "
+                           "the worker processes.")
+    def __setitem__(self, indx, value):
+        self._call('__setitem__', indx, value)
+        self.covar_is_current = False
+    def thaw(self, i):
+        self._call('thaw', i)
+    def freeze(self, i):
+        self._call('freeze', i)
+    def setFitTolType(self, tolType):
+        if tolType in (pyLike.RELATIVE, pyLike.ABSOLUTE):
+            self.tolType = tolType
+        else:
+            raise RuntimeError("Invalid fit tolerance type. " +
+                               "Valid values are 0=RELATIVE or 1=ABSOLUTE")
+    def addPrior(self, srcName, parName, funcname, **kwds):
+        self._request('call', 'addPrior', (srcName, parName, funcname), kwds)
+    def addGaussianPrior(self, srcName, parName, mean, sigma):
+        self._request('call', 'addGaussianPrior',
+                      (srcName, parName, mean, sigma))
+    def removePrior(self, srcName, parName):
+        return self._request('call', 'removePrior', (srcName, parName))
+    def setPriorParams(self, srcName, parName, **kwds):
+        self._request('call', 'setPriorParams', (srcName, parName), kwds)
+    def removePriors(self):
+        self._request('call', 'removePriors')
+    def getPriors(self):
+        return self._request('call', 'getPriors')
+    def addPriors(self, prior_dict):
+        self._request('call', 'addPriors', (prior_dict,))
+    def writeXml(self, xmlFile=None):
+        self._request('call', 'writeXml', (xmlFile,))
+    def Ts(self, srcName, reoptimize=False, approx=True,
+           tol=None, MaxIterations=10, verbosity=0):
+        """TS of srcName: the source is removed from every component,
+        the remaining free parameters are refit if reoptimize=True or
+        the nearby and diffuse normalizations are scaled up to account
+        for the missing counts if approx=True, as in SummedLikelihood,
+        and the source and the original parameter values are
+        restored."""
+        if verbosity > 0:
+            print ("*** Start Ts_dl ***")
+        freeParams = self.freeParamValues()
+        logLike1 = -self()
+        self._broadcast('removeSource', srcName)
+        try:
+            logLike0 = -self()
+            if tol is None:
+                tol = self.tol
+            n_free_base = self.nFreeParams()
+            if reoptimize and n_free_base > 0:
+                if verbosity > 0:
+                    print ("** Do reoptimize")
+                optFactory = pyLike.OptimizerFactory.instance()
+                myOpt = optFactory.create(self.optimizer, self.statistic())
+                Niter = 1
+                while Niter <= MaxIterations:
+                    try:
+                        myOpt.find_min(0, tol)
+                        break
+                    except RuntimeError as e:
+                        print (e)
+                    if verbosity > 0:
+                        print ("** Iteration :",Niter)
+                    Niter += 1
+                self._setStatisticValues()
+            elif approx and n_free_base > 0:
+                try:
+                    self._renorm()
+                except ZeroDivisionError:
+                    pass
+            logLike0 = max(-self(), logLike0)
+        finally:
+            self._broadcast('restoreSource', srcName)
+            self.setFreeParamValues(freeParams)
+        return 2*(logLike1 - logLike0)
+    def _renorm(self, factor=None):
+        info = self._broadcast('renormInfo')
+        # Scale the free normalizations of the diffuse and nearby sources,
+        # as selected by the first component.
+        scaled = [item[0] for item in info[0] if item[2] and item[3]]
+        if factor is None:
+            npreds = [sum(items) for items in
+                      zip(*[[item[1] for item in comp] for comp in info])]
+            freeNpred = sum(npred for item, npred in zip(info[0], npreds)
+                            if item[0] in scaled)
+            deficit = self.total_nobs() - sum(npreds)
+            self.renormFactor = 1. + deficit/freeNpred
+        else:
+            self.renormFactor = factor
+        if self.renormFactor < 1:
+            self.renormFactor = 1
+        for src in scaled:
+            parameter = self.normPar(src)
+            oldValue = parameter.getValue()
+            newValue = oldValue*self.renormFactor
+            # ensure new value is within parameter bounds
+            xmin, xmax = parameter.getBounds()
+            if xmin <= newValue and newValue <= xmax:
+                parameter.setValue(newValue)
@@ -0,0 +1,108 @@
+"""
+@brief On-disk cache of the per-event diffuse source responses
+computed by LogLike.computeEventResponses.
+"""
+# $Header$
+
+import os
+import re
+import hashlib
+import tempfile
+from xml.dom import minidom
+import numpy as num
+
+def _expandPath(path):
+    "Expand environment variables written as $(VAR), ${VAR} or $VAR."
+    return os.path.expandvars(re.sub(r'\$\((\w+)\)', r'${\1}', path))
+
+def _fileStamp(path):
+    "Absolute path, size and modification time of a file."
+    path = _expandPath(path)
+    stat = os.stat(path)
+    return '%s %i %r' % (os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+def _spatialModels(srcModel):
+    """Map of source name to the xml of its spatial model and the files
+    (e.g., the map or map cube) that it refers to."""
+    models = {}
+    try:
+        doc = minidom.parse(srcModel)
+    except (IOError, OSError, TypeError):
+        return models
+    for src in doc.getElementsByTagName('source'):
+        spatial = src.getElementsByTagName('spatialModel')
+        if spatial:
+            mapFile = spatial[0].getAttribute('file')
+            files = [mapFile] if mapFile else []
+            models[src.getAttribute('name')] = (spatial[0].toxml(), files)
+    return models
+
+class EventResponseCache(object):
+    """Store the diffuse responses of the events of an UnbinnedObs, one
+    .npy file per diffuse source, in the directory "cacheDir".  Files are
+    named by a hash of the event files (with their sizes and
+    modification times), the IRFs, the ROI cuts, the xml definition of
+    the source's spatial model and the files it refers to (again with
+    their sizes and modification times), so a change to any of these,
+    including a template replaced under the same name, gives a new
+    entry.  Entries are loaded as read-only memory maps.
+
+    Only one response value per event is stored, so responses computed
+    with energy dispersion are not cached."""
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+    def key(self, observation, spatialModel, files=()):
+        roiCuts = observation.roiCuts()
+        region = roiCuts.extractionRegion()
+        items = [observation.irfs, spatialModel,
+                 repr(roiCuts.getEnergyCuts()),
+                 repr((roiCuts.minTime(), roiCuts.maxTime())),
+                 repr((region.center().ra(), region.center().dec(),
+                       region.radius()))]
+        for eventFile in observation.eventFiles:
+            items.append(_fileStamp(eventFile))
+        for item in files:
+            items.append(_fileStamp(item))
+        return hashlib.sha1('\n'.join(items).encode()).hexdigest()
+    def _path(self, key):
+        return os.path.join(self.cacheDir, key + '.npy')
+    def load(self, key):
+        """Return the cached responses as a memory-mapped array, or None."""
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        return num.load(path, mmap_mode='r')
+    def save(self, key, responses):
+        """Write the responses atomically, so that concurrent jobs never
+        read a partial file."""
+        fd, tmpfile = tempfile.mkstemp(dir=self.cacheDir, suffix='.npy')
+        with os.fdopen(fd, 'wb') as output:
+            num.save(output, num.asarray(responses, dtype=float))
+        os.replace(tmpfile, self._path(key))
+    def computeEventResponses(self, like):
+        """Load the cached responses of the diffuse sources of the
+        UnbinnedAnalysis object "like", call computeEventResponses for
+        the others and add those to the cache."""
+        obs = like.observation
+        if obs._respFuncs.useEdisp():
+            like.logLike.computeEventResponses()
+            return
+        eventCont = obs.eventCont()
+        nevents = eventCont.events().size()
+        spatialModels = _spatialModels(like.srcModel)
+        missing = {}
+        for srcName in like.sourceNames():
+            if (like.logLike.getSource(srcName).getType() != 'Diffuse'
+                or srcName not in spatialModels):
+                continue
+            key = self.key(obs, *spatialModels[srcName])
+            responses = self.load(key)
+            if responses is not None and len(responses) == nevents:
+                eventCont.setDiffuseResponses(srcName, responses)
+            else:
+                missing[srcName] = key
+        like.logLike.computeEventResponses()
+        for srcName, key in missing.items():
+            self.save(key, eventCont.getDiffuseResponses(srcName))
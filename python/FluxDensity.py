@@ -10,55 +10,58 @@ estimate the 1 sigma error.
 #
 
 import numpy as num
-import pyLikelihood as pyLike
+from CovarianceView import CovarianceView
+
+def spectrumValues(spectrum, energies):
+    """Values of a spectral function at each of the energies, as a
+    numpy array, evaluated in a single call."""
+    energies = num.asarray(energies, dtype=float)
+    values = spectrum.values(energies.ravel().tolist())
+    return num.array(values).reshape(energies.shape)
+
+def spectrumDerivs(spectrum, energies, parNames):
+    """Derivatives of a spectral function with respect to each of the
+    parameters in parNames at each of the energies, as a numpy array of
+    shape (len(parNames), len(energies))."""
+    energies = num.asarray(energies, dtype=float).ravel()
+    derivs = spectrum.derivsByParams(energies.tolist(), list(parNames))
+    return num.array(derivs).reshape(len(parNames), len(energies))
 
 class FluxDensity(object):
     def __init__(self, like, srcName):
         self.like = like
         self.srcName = srcName
         self.src = like[srcName].src
-        par_index_map = {}
-        indx = 0
-        for src in like.sourceNames():
-            parNames = pyLike.StringVector()
-            like[src].src.spectrum().getFreeParamNames(parNames)
-            for par in parNames:
-                par_index_map["::".join((src, par))] = indx
-                indx += 1
         #
         # Build the source-specific covariance matrix.
         #
-        if like.covariance is None:
-            raise RuntimeError("Covariance matrix has not been computed.")
-        covar = num.array(like.covariance)
-        if len(covar) != len(par_index_map):
-            raise RuntimeError("Covariance matrix size does not match the " +
-                               "number of free parameters.")
-        my_covar = []
-        srcpars = pyLike.StringVector()
-        like[srcName].src.spectrum().getFreeParamNames(srcpars)
-        pars = ["::".join((srcName, x)) for x in srcpars]
-        for xpar in pars:
-            ix = par_index_map[xpar]
-            my_covar.append([covar[ix][par_index_map[ypar]] for ypar in pars])
-        self.covar = num.array(my_covar)
-        self.srcpars = srcpars
+        if hasattr(like, 'covarianceView'):
+            view = like.covarianceView()
+        else:
+            view = CovarianceView(like)
+        self.covar = view.block(srcName)
+        self.srcpars = view.parNames(srcName)
     def value(self, energy):
-        arg = pyLike.dArg(energy)
-        return self.src.spectrum()(arg)
+        """dN/dE at energy, which may be a scalar or an array."""
+        values = spectrumValues(self.src.spectrum(), num.atleast_1d(energy))
+        if num.isscalar(energy):
+            return values[0]
+        return values
     def error(self, energy):
-        arg = pyLike.dArg(energy)
-        partials = num.array([self.src.spectrum().derivByParam(arg, x) 
-                              for x in self.srcpars])
-        return num.sqrt(num.dot(partials, num.dot(self.covar, partials)))
+        """1 sigma error on dN/dE at energy (scalar or array)."""
+        partials = spectrumDerivs(self.src.spectrum(),
+                                  num.atleast_1d(energy), self.srcpars)
+        errors = num.sqrt(num.einsum('ik,ij,jk->k', partials, self.covar,
+                                     partials))
+        if num.isscalar(energy):
+            return errors[0]
+        return errors
     def write_nuFnu(self, outfile, emin=100, emax=3e5, npts=500):
         estep = num.log(emax/emin)/(npts - 1)
         energies = emin*num.exp(estep*num.arange(npts, dtype=float))
+        nuFnu = energies**2*self.value(energies)*1.602e-6
+        dnuFnu = energies**2*self.error(energies)*1.602e-6
         output = open(outfile, 'w')
-        for ee in energies:
-            F = self.value(ee)
-            dF = self.error(ee)
-            nuFnu = ee**2*F*1.602e-6
-            dnuFnu =  ee**2*dF*1.602e-6
-            output.write("%12.4e  %12.4e  %12.4e\n" % (ee, nuFnu, dnuFnu))
+        for ee, F, dF in zip(energies, nuFnu, dnuFnu):
+            output.write("%12.4e  %12.4e  %12.4e\n" % (ee, F, dF))
         output.close()
@@ -12,6 +12,15 @@ $Id: IntegralUpperLimit.py,v 1.7 2016/10/14 17:41:40 echarles Exp $
 See help for IntegralUpperLimits.calc for full details.
 """
 
+# 2026-10-17: scipy is imported by the functions that use it rather
+# than at module load, since many scripts import this module (e.g.,
+# through SED) without calculating any upper limits.
+
+# 2026-10-17: The nuisance cache is now a ProfileCache object, which
+# can be passed in through the "cache" argument and shared with
+# UpperLimits and AnalysisBase.scan. The optimized likelihood at each
+# value of the parameter is memoized by a ProfileLikelihood object.
+
 # 2011-09-27: Whenever possible call the Python Likelihood classes
 # rather than the underlying C++ class - therefore, all references to
 # "like.logLike" removed. This allows the code to work with
@@ -31,81 +40,12 @@ See help for IntegralUpperLimits.calc for full details.
 # nuisance parameters by extrapolating them from previous iterations.
 # This makes Minuit quicker (at least when using strategy 0)
 
-import UnbinnedAnalysis
-import scipy.integrate
-import scipy.interpolate
-import scipy.optimize
-import scipy.stats
 import math
 from LikelihoodState import LikelihoodState
-
-def _guess_nuisance(x, like, cache):
-    """Internal function which guesses the value of a nuisance
-    parameter before the optimizer is called by interpolating from
-    previously found values. Not intended for use outside of this
-    package."""
-    X = list(cache.keys())
-    X.sort()
-    if len(X)<2:
-        return
-    elif x>max(X):
-        _reset_nuisance(max(X), like, cache)
-        return
-    elif x<min(X):
-        _reset_nuisance(min(X), like, cache)
-        return        
-    sync_name = ""
-    icache = 0
-    for iparam in range(len(like.model.params)):
-        if sync_name != like[iparam].srcName:
-            like.syncSrcParams(sync_name)
-            sync_name = ""
-        if(like.model[iparam].isFree()):
-            Y = []
-            for ix in X: Y.append(cache[ix][icache])
-            # Simple interpolation is best --- DO NOT use splines!
-            p = scipy.interpolate.interp1d(X,Y)(x).item()
-            limlo, limhi = like.model[iparam].getBounds()
-            p = max(limlo, min(p, limhi))
-            like.model[iparam].setValue(p)
-            sync_name = like[iparam].srcName
-            icache += 1
-    if sync_name != "":
-        like.syncSrcParams(sync_name)
-
-def _reset_nuisance(x, like, cache):
-    """Internal function which sets the values of the nuisance
-    parameters to those found in a previous iteration of the
-    optimizer. Not intended for use outside of this package."""
-    sync_name = ""
-    icache = 0
-    if x in cache:
-        params = cache[x]
-        for iparam in range(len(like.model.params)):
-            if sync_name != like[iparam].srcName:
-                like.syncSrcParams(sync_name)
-                sync_name = ""
-            if(like.model[iparam].isFree()):
-                like.model[iparam].setValue(params[icache])
-                sync_name = like[iparam].srcName
-                icache += 1
-        if sync_name != "":
-            like.syncSrcParams(sync_name)
-        return True
-    return False
-
-def _cache_nuisance(x, like, cache):
-    """Internal function which caches the values of the nuisance
-    parameters found after optimization so that they can be used
-    again. Not intended for use outside of this package."""
-    params = []
-    for iparam in range(len(like.model.params)):
-        if(like.model[iparam].isFree()):
-            params.append(like.model[iparam].value())
-    cache[x] = params
+from ProfileLikelihood import ProfileLikelihood
 
 def _loglike(x, like, par, srcName, offset, verbosity, no_optimizer,
-             optvalue_cache, nuisance_cache):
+             optvalue_cache, profile):
     """Internal function used by the SciPy integrator and root finder
     to evaluate the likelihood function. Not intended for use outside
     of this package."""
@@ -123,36 +63,28 @@ def _loglike(x, like, par, srcName, offset, verbosity, no_optimizer,
     if no_optimizer:
         return -like() - offset
 
-    # Call the optimizer of the optimum value is not in the cache OR if
-    # we fail to reset the nuisance parameters to those previously found
-    optvalue = None
-    if ((optvalue_cache == None) or (nuisance_cache == None) or
-        (x not in optvalue_cache) or
-        (_reset_nuisance(x, like, nuisance_cache) == False)):
+    # Call the optimizer unless the profile likelihood already has the
+    # optimized value at this point
+    if profile != None:
+        negLogLike = profile(x)
+    else:
         try:
-            if(nuisance_cache != None):
-                _guess_nuisance(x, like, nuisance_cache)
             like.optimize(optverbosity)
-            if(nuisance_cache != None):
-                _cache_nuisance(x, like, nuisance_cache)
         except RuntimeError:
             like.optimize(optverbosity)
-            if(nuisance_cache != None):
-                _cache_nuisance(x, like, nuisance_cache)
-        optvalue = -like()
-        if(optvalue_cache != None):
-            optvalue_cache[x] = optvalue
-    else:
-        optvalue = optvalue_cache[x]
+        negLogLike = like()
+    optvalue = -negLogLike
+    if(optvalue_cache != None):
+        optvalue_cache[x] = optvalue
     return optvalue - offset
 
 def _integrand(x, f_of_x, like, par, srcName, maxval, verbosity,
-               no_optimizer, optvalue_cache, nuisance_cache):
+               no_optimizer, optvalue_cache, profile):
     """Internal function used by the SciPy integrator to evaluate the
     likelihood function. Not intended for use outside of this package."""
 
     f = math.exp(_loglike(x,like,par,srcName,maxval,verbosity,no_optimizer,
-                          optvalue_cache,nuisance_cache))
+                          optvalue_cache,profile))
     f_of_x[x] = f
     if verbosity:
         print ("Function evaluation:", x, f)
@@ -173,12 +105,12 @@ def _approxroot(x, approx_cache, like, par, srcName, subval, verbosity):
     return f
 
 def _root(x, like, par, srcName, subval, verbosity,
-          no_optimizer, optvalue_cache, nuisance_cache):
+          no_optimizer, optvalue_cache, profile):
     """Internal function used by the SciPy root finder to evaluate the
     likelihood function. Not intended for use outside of this package."""
 
     f = _loglike(x, like, par, srcName, subval, verbosity, no_optimizer,
-                 optvalue_cache, nuisance_cache)
+                 optvalue_cache, profile)
     if verbosity:
         print ("Exact function root evaluation:", x, f)
     return f
@@ -187,12 +119,14 @@ def _splintroot(xhi, yseek, xlo, spl_rep):
     """Internal function used by the SciPy root finder to find the
     point where integral of (spline) likelihood passes desired
     threshold.  Not intended for use outside of this package."""
+    import scipy.interpolate
     return scipy.interpolate.splint(xlo,xhi,spl_rep)-yseek
 
 def _splevroot(x, yseek, spl_rep):
     """Internal function used by the SciPy root finder to find the
     point where the (spline of the) log-likelihood passes desired
     threshold.  Not intended for use outside of this package."""
+    import scipy.interpolate
     return scipy.interpolate.splev(x, spl_rep)-yseek
 
 def _int1droot(x, yseek, int_rep):
@@ -206,13 +140,14 @@ def _find_interval(like, par, srcName, no_optimizer,
                    maxval, fitval, limlo, limhi,
                    delta_log_like_limits = 2.71/2, verbosity = 0, tol = 0.01, 
                    no_lo_bound_search = False, nloopmax = 5,
-                   optvalue_cache = dict(), nuisance_cache = dict()):
+                   optvalue_cache = None, profile = None):
     """Internal function to search for interval of the normalization
     parameter in which the log Likelihood is larger than predefined
     value. Used to find the upper limit in the profile method and to
     find sensible limits of integration in the Bayesian method. Use
     the SciPy Brent method root finder to do the search. Use new fast
     method for up to nloopmax iterations then fall back to old method."""
+    import scipy.optimize
 
     subval = maxval - delta_log_like_limits
     search_xtol = limlo*0.1
@@ -240,10 +175,16 @@ def _find_interval(like, par, srcName, no_optimizer,
     # optimal values from call to call. THIS COMMENT IS OBSOLETED
     # BY PREVIOUS COMMENT EXCEPT IF/WHEN NEW METHOD FAILS.
 
+    if optvalue_cache == None:
+        optvalue_cache = dict()
+    if profile == None:
+        profile = ProfileLikelihood(like, srcName, par.getName(),
+                                    verbosity=max(verbosity-1, 0))
+
     exact_root_evals = -len(optvalue_cache)
     approx_root_evals = 0
     
-    temp_saved_state = LikelihoodState(like)
+    temp_saved_state = LikelihoodState(like, compact=True)
 
     # HI BOUND
 
@@ -264,7 +205,7 @@ def _find_interval(like, par, srcName, no_optimizer,
         else:
             xtst = xrgt
         ytst = _root(xtst, like, par,srcName, subval, verbosity,
-                     no_optimizer, optvalue_cache, nuisance_cache)
+                     no_optimizer, optvalue_cache, profile)
         if ytst<=0: xrgt=xtst
         else: xlft=xtst
         iloop += 1
@@ -286,21 +227,21 @@ def _find_interval(like, par, srcName, no_optimizer,
             xtst = max(xlft*10.0, xlft+(limhi-limlo)*1e-4)            
             while(xtst<xrgt and\
                   _root(xtst, like,par, srcName, subval, verbosity,
-                        no_optimizer, optvalue_cache, nuisance_cache)>=0):
+                        no_optimizer, optvalue_cache, profile)>=0):
                 xtst *= 10.0
             if(xtst<xrgt):
                 xrgt = xtst
         if xrgt>limhi: xrgt=limhi
         if xrgt<limhi or \
                _root(xrgt, like, par, srcName, subval, verbosity,
-                     no_optimizer, optvalue_cache, nuisance_cache)<0:
+                     no_optimizer, optvalue_cache, profile)<0:
             xhi = scipy.optimize.brentq(_root, xlft, xrgt, xtol=search_xtol,
                                         args = (like,par,srcName,\
                                                 subval,verbosity,no_optimizer,
-                                                optvalue_cache,nuisance_cache))
+                                                optvalue_cache,profile))
             pass
         yhi = _root(xhi, like, par, srcName, subval, verbosity,
-                    no_optimizer, optvalue_cache, nuisance_cache)
+                    no_optimizer, optvalue_cache, profile)
         pass
 
     temp_saved_state.restore()
@@ -330,7 +271,7 @@ def _find_interval(like, par, srcName, no_optimizer,
         else:
             xtst = xlft
         ytst = _root(xtst, like, par, srcName, subval, verbosity,
-                     no_optimizer, optvalue_cache, nuisance_cache)
+                     no_optimizer, optvalue_cache, profile)
         if ytst<=0: xlft=xtst
         else: xrgt=xtst
         approx_root_evals += len(approx_cache)-1
@@ -352,21 +293,21 @@ def _find_interval(like, par, srcName, no_optimizer,
             xtst = min(xrgt*0.1, xrgt-(limhi-limlo)*1e-4)            
             while(xtst>xlft and\
                   _root(xtst, like,par, srcName, subval, verbosity,
-                        no_optimizer, optvalue_cache, nuisance_cache)>=0):
+                        no_optimizer, optvalue_cache, profile)>=0):
                 xtst *= 0.1
             if(xtst>xlft):
                 xlft = xtst
         if xlft<limlo: xlft=limlo
         if xlft>limlo or \
                _root(xlft, like, par, srcName, subval, verbosity,
-                     no_optimizer, optvalue_cache, nuisance_cache)<0:
+                     no_optimizer, optvalue_cache, profile)<0:
             xlo = scipy.optimize.brentq(_root, xlft, xrgt, xtol=search_xtol,
                                         args = (like,par,srcName,\
                                                 subval,verbosity,no_optimizer,
-                                                optvalue_cache,nuisance_cache))
+                                                optvalue_cache,profile))
             pass
         ylo = _root(xlo, like, par, srcName, subval, verbosity,
-                    no_optimizer, optvalue_cache, nuisance_cache)
+                    no_optimizer, optvalue_cache, profile)
         pass
 
     temp_saved_state.restore()
@@ -381,7 +322,7 @@ def calc(like, srcName, *args, **kwargs):
 def calc_int(like, srcName, cl=0.95, verbosity=0,
              skip_global_opt=False, be_very_careful=False, freeze_all=False,
              delta_log_like_limits = 10.0, profile_optimizer = None,
-             emin=100, emax=3e5, poi_values = []):
+             emin=100, emax=3e5, poi_values = [], cache = None):
     """Calculate an integral upper limit by direct integration.
 
   Description:
@@ -454,6 +395,10 @@ def calc_int(like, srcName, cl=0.95, verbosity=0,
         \"results.poi_probs\". This parameter must be a vector, and can be
         empty.
 
+    cache -- a ProfileCache of optimized nuisance parameters, which can
+        be shared with other upper limit or scan calculations on the same
+        model. By default a new one is used.
+
   Outputs: (limit, results)
 
     limit -- the flux limit found.
@@ -462,7 +407,12 @@ def calc_int(like, srcName, cl=0.95, verbosity=0,
         calculation, such as the value of the peak, the profile of the
         likelihood and two profile-likelihood upper-limits.
   """  
-    saved_state = LikelihoodState(like)
+    import scipy.integrate
+    import scipy.interpolate
+    import scipy.optimize
+    import scipy.stats
+
+    saved_state = LikelihoodState(like, compact=True)
 
     ###########################################################################
     #
@@ -535,9 +485,10 @@ def calc_int(like, srcName, cl=0.95, verbosity=0,
 
     # Set up the caches for the optimum values and nuisance parameters
     optvalue_cache = dict()
-    nuisance_cache = dict()
+    profile = ProfileLikelihood(like, srcName, par.getName(), cache=cache,
+                                verbosity=max(verbosity-1, 0))
     optvalue_cache[fitval] = maxval
-    _cache_nuisance(fitval, like, nuisance_cache)
+    profile.store(fitval, -maxval)
 
     # Test if all parameters are frozen (could be true if we froze
     # them above or if they were frozen in the user's model
@@ -562,7 +513,7 @@ def calc_int(like, srcName, cl=0.95, verbosity=0,
     _find_interval(like, par, srcName, all_frozen,
                    maxval, fitval, limlo, limhi,
                    delta_log_like_limits, verbosity, like.tol,
-                   False, 5, optvalue_cache, nuisance_cache)
+                   False, 5, optvalue_cache, profile)
 
     if poi_values != None and len(poi_values)>0:
         xlo = max(min(xlo, min(poi_values)/2.0), limlo)
@@ -610,7 +561,7 @@ def calc_int(like, srcName, cl=0.95, verbosity=0,
           scipy.integrate.quad(_integrand, xlo, xhi,\
                                args = (f_of_x, like, par, srcName, maxval,\
                                        verbosity, all_frozen,
-                                       optvalue_cache, nuisance_cache),\
+                                       optvalue_cache, profile),\
                                points=points, epsrel=epsrel, epsabs=1)
     nfneval += len(optvalue_cache)
 
@@ -801,7 +752,8 @@ def calc_int(like, srcName, cl=0.95, verbosity=0,
 
 def calc_chi2(like, srcName, cl=0.95, verbosity=0,
               skip_global_opt=False, freeze_all=False,
-              profile_optimizer = None, emin=100, emax=3e5, poi_values = []):
+              profile_optimizer = None, emin=100, emax=3e5, poi_values = [],
+              cache = None):
     """Calculate an integral upper limit by the profile likelihood (chi2) method.
 
   Description:
@@ -857,6 +809,10 @@ def calc_chi2(like, srcName, cl=0.95, verbosity=0,
         \"results.poi_probs\". This parameter must be a vector, and can be
         empty.
 
+    cache -- a ProfileCache of optimized nuisance parameters, which can
+        be shared with other upper limit or scan calculations on the same
+        model. By default a new one is used.
+
   Outputs: (limit, results)
 
     limit -- the flux limit found.
@@ -864,8 +820,9 @@ def calc_chi2(like, srcName, cl=0.95, verbosity=0,
     results -- a dictionary of additional results from the calculation,
         such as the value of the peak value etc.
   """
+    import scipy.stats
 
-    saved_state = LikelihoodState(like)
+    saved_state = LikelihoodState(like, compact=True)
 
     ###########################################################################
     #
@@ -931,9 +888,10 @@ def calc_chi2(like, srcName, cl=0.95, verbosity=0,
 
     # Set up the caches for the optimum values and nuisance parameters
     optvalue_cache = dict()
-    nuisance_cache = dict()
+    profile = ProfileLikelihood(like, srcName, par.getName(), cache=cache,
+                                verbosity=max(verbosity-1, 0))
     optvalue_cache[fitval] = maxval
-    _cache_nuisance(fitval, like, nuisance_cache)
+    profile.store(fitval, -maxval)
 
     # Test if all parameters are frozen (could be true if we froze
     # them above or if they were frozen in the user's model
@@ -960,7 +918,7 @@ def calc_chi2(like, srcName, cl=0.95, verbosity=0,
     _find_interval(like, par, srcName, all_frozen,
                    maxval, fitval, limlo, limhi,
                    delta_log_like, verbosity, like.tol,
-                   True, 5, optvalue_cache, nuisance_cache)
+                   True, 5, optvalue_cache, profile)
 
     if verbosity:
         print ("Limit: %g (%d full fcn evals and %d approx)"\
@@ -983,7 +941,7 @@ def calc_chi2(like, srcName, cl=0.95, verbosity=0,
             pval = 0.0
         else:
             dlogL = _loglike(xval, like, par, srcName, maxval, verbosity,
-                             all_frozen, optvalue_cache, nuisance_cache)
+                             all_frozen, optvalue_cache, profile)
             if(xval<fitval):
                 pval = 0.5*(1-scipy.stats.chi2.cdf(-2*dlogL,1))
             else:
@@ -1032,6 +990,7 @@ def calc_chi2(like, srcName, cl=0.95, verbosity=0,
 
 if __name__ == "__main__":
     import sys
+    import UnbinnedAnalysis
 
     srcName = "EMS0001"
     obs = UnbinnedAnalysis.UnbinnedObs('ft1_roi.fits',
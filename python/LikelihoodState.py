@@ -6,6 +6,7 @@
 #
 # $Header: /nfs/slac/g/glast/ground/cvs/ScienceTools-scons/pyLikelihood/python/LikelihoodState.py,v 1.5 2012/11/20 16:49:52 jchiang Exp $
 #
+import numpy as num
 import pyLikelihood
 
 #class _Parameter(object):
@@ -48,17 +49,41 @@ class _Parameter(object):
 
 class LikelihoodState(object):
     """Save the parameter state of a pyLikelihood object and provide a
-    method to restore everything or just a specific source."""
-    def __init__(self, like, negLogLike=None):
+    method to restore everything or just a specific source.
+
+    With compact=True, the value, bounds, scale, free flag and error of
+    every spectral parameter are read into one (npar, 6) array per
+    LogLike object, and restore() writes them back with a single call
+    per LogLike instead of copying pyLikelihood.Parameter objects one
+    at a time.  Other parameter attributes, such as the alwaysFixed
+    flag and priors, are not part of the snapshot and are left as they
+    are."""
+    def __init__(self, like, negLogLike=None, compact=False):
         if negLogLike is None:
             self.negLogLike = like()
         else:
             self.negLogLike = negLogLike
         self.like = like
-        self.pars = [_Parameter(par) for par in like.params()]
+        self.compact = compact
+        if compact:
+            self.par_data = [num.array(logLike.getSpectralParamData()
+                                       ).reshape(-1, 6)
+                             for logLike in self._logLikes()]
+        else:
+            self.pars = [_Parameter(par) for par in like.params()]
         self.covariance = like.covariance
         self.covar_is_current = like.covar_is_current 
+    def _components(self):
+        try:
+            return self.like.components
+        except AttributeError:
+            return [self.like]
+    def _logLikes(self):
+        return [component.logLike for component in self._components()]
     def restore(self, srcName=None):
+        if self.compact:
+            self._restore_compact(srcName)
+            return
         if srcName is None:
             for par, likePar in zip(self.pars, self.like.params()):
                 par.setDataMembers(likePar)
@@ -72,3 +97,28 @@ class LikelihoodState(object):
                 likePar = self.like.params()[indx]
                 self.pars[indx].setDataMembers(likePar)
         self.like.syncSrcParams()
+    def _restore_compact(self, srcName):
+        # setSpectralParamData also synchronizes the LogLike objects, so
+        # the restored sources no longer need to be flagged as modified.
+        components = self._components()
+        if srcName is None:
+            for component, par_data in zip(components, self.par_data):
+                component.logLike.setSpectralParamData(
+                    par_data.ravel().tolist())
+                for source in component.model.srcs.values():
+                    source.is_modified = False
+            self.like.covariance = self.covariance
+            self.like.covar_is_current = self.covar_is_current
+            return
+        parNames = pyLikelihood.StringVector()
+        self.like[srcName].src.spectrum().getParamNames(parNames)
+        for component, par_data in zip(components, self.par_data):
+            # The components may have different source lists, so each
+            # one is indexed with its own parameter numbering.
+            indices = [component.par_index(srcName, parName)
+                       for parName in parNames]
+            current = num.array(component.logLike.getSpectralParamData()
+                                ).reshape(-1, 6)
+            current[indices] = par_data[indices]
+            component.logLike.setSpectralParamData(current.ravel().tolist())
+            component.model.srcs[srcName].is_modified = False
@@ -0,0 +1,125 @@
+"""
+@brief Compute TS values and upper limits for many sources in parallel
+by distributing the source names over a pool of forked worker
+processes.
+"""
+# $Header$
+
+import os
+import tempfile
+import multiprocessing
+import numpy as num
+from UpperLimits import UpperLimit
+
+_worker_like = None
+
+def _analysis_factory(like):
+    """Return a function that builds a new analysis object of the same
+    type as "like" from a source model xml file, reusing the
+    observation object of "like" and, for binned analyses, its weights
+    map and BinnedConfig."""
+    if hasattr(like, 'binnedData'):
+        from BinnedAnalysis import BinnedAnalysis
+        def factory(srcModel):
+            return BinnedAnalysis(like.binnedData, srcModel, like.optimizer,
+                                  wmap=like.wmapFile, config=like.config)
+    elif hasattr(like, 'observation'):
+        from UnbinnedAnalysis import UnbinnedAnalysis
+        def factory(srcModel):
+            return UnbinnedAnalysis(like.observation, srcModel, like.optimizer)
+    else:
+        raise RuntimeError("Cannot rebuild %s objects in the workers; "
+                           "please provide a factory function."
+                           % like.__class__.__name__)
+    return factory
+
+def _init_worker(factory, srcModel, tol, tolType):
+    global _worker_like
+    _worker_like = factory(srcModel)
+    _worker_like.tol = tol
+    _worker_like.setFitTolType(tolType)
+
+def _process_source(args):
+    srcName, compute_ts, compute_ul, ts_kwds, ul_kwds = args
+    ts_value = flux_ul = par_ul = num.nan
+    try:
+        if compute_ts:
+            ts_value = _worker_like.Ts(srcName, **ts_kwds)
+        if compute_ul:
+            flux_ul, par_ul = UpperLimit(_worker_like,
+                                         srcName).compute(**ul_kwds)
+    except RuntimeError as message:
+        print ("Worker %i failed for source %s: %s"
+               % (os.getpid(), srcName, message))
+    return srcName, ts_value, flux_ul, par_ul
+
+class ParallelSourceDriver(object):
+    """Evaluate TS values and upper limits, which are independent from
+    one source to the next, in a pool of worker processes.  Each
+    worker builds its own BinnedAnalysis or UnbinnedAnalysis object
+    once, from the observation of "like" and a snapshot of its current
+    source model, so the SWIG objects never need to be pickled.  A
+    different "factory" function taking the name of a source model xml
+    file and returning an analysis object may be given, e.g., to pass
+    a non-default BinnedConfig."""
+    def __init__(self, like, n_workers=None, factory=None):
+        self.like = like
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        self.n_workers = n_workers
+        if factory is None:
+            factory = _analysis_factory(like)
+        self.factory = factory
+    def Ts(self, srcNames=None, **kwds):
+        """Return a dictionary of TS values keyed by source name. The
+        keyword arguments are passed to the Ts method of each worker's
+        analysis object."""
+        results = self.run(srcNames, compute_ts=True, ts_kwds=kwds)
+        return dict(zip(results['name'], results['ts']))
+    def upperLimits(self, srcNames=None, **kwds):
+        """Return a dictionary of (flux, parameter value) upper limit
+        pairs keyed by source name. The keyword arguments are passed to
+        UpperLimit.compute."""
+        results = self.run(srcNames, compute_ts=False, compute_ul=True,
+                           ul_kwds=kwds)
+        return dict((name, (flux, par)) for name, flux, par in
+                    zip(results['name'], results['flux_ul'],
+                        results['par_ul']))
+    def run(self, srcNames=None, compute_ts=True, compute_ul=False,
+            ts_kwds=None, ul_kwds=None):
+        """Process the sources in "srcNames" (default is all sources in
+        the model) and return a record array with fields name, ts,
+        flux_ul and par_ul, in the order of "srcNames".  Quantities that
+        were not requested or could not be computed are set to NaN."""
+        if srcNames is None:
+            srcNames = self.like.sourceNames()
+        if ts_kwds is None:
+            ts_kwds = {}
+        if ul_kwds is None:
+            ul_kwds = {}
+        ul_kwds.setdefault('verbosity', 0)
+        fd, srcModel = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+        try:
+            self.like.logLike.writeXml(srcModel)
+            tasks = [(name, compute_ts, compute_ul, ts_kwds, ul_kwds)
+                     for name in srcNames]
+            context = multiprocessing.get_context('fork')
+            pool = context.Pool(self.n_workers, _init_worker,
+                                (self.factory, srcModel, self.like.tol,
+                                 self.like.tolType))
+            try:
+                output = pool.map(_process_source, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            os.remove(srcModel)
+        name_len = max([len(name) for name in srcNames] + [1])
+        results = num.zeros(len(output),
+                            dtype=[('name', 'U%i' % name_len),
+                                   ('ts', float), ('flux_ul', float),
+                                   ('par_ul', float)])
+        for i, row in enumerate(output):
+            results[i] = row
+        return results.view(num.recarray)
@@ -0,0 +1,86 @@
+"""
+@brief Cache of optimized nuisance parameters found while profiling
+the likelihood in one parameter, used to warm-start the optimizer at
+nearby values.
+"""
+# $Header$
+
+import bisect
+from collections import OrderedDict
+import numpy as num
+import pyLikelihood as pyLike
+
+def _freeParamValues(like):
+    values = pyLike.DoubleVector()
+    like.logLike.getFreeParamValues(values)
+    return tuple(values)
+
+class ProfileCache(object):
+    """Store, for each (source, parameter, value), the optimized
+    -log-likelihood and the values of the free (nuisance) parameters.
+    The same object can be passed to UpperLimit, AnalysisBase.scan and
+    the IntegralUpperLimit functions so that profile points already
+    found by one are reused by the others.  If "maxsize" is given, at
+    most that many points are kept per parameter, discarding the least
+    recently used.  Entries are only valid for a fixed model and data
+    selection; call clear() if either changes."""
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._profiles = {}
+    def clear(self):
+        self._profiles = {}
+    def _profile(self, srcName, parName):
+        return self._profiles.setdefault((srcName, parName), OrderedDict())
+    def values(self, srcName, parName):
+        "Sorted parameter values with cached profile points."
+        return sorted(self._profile(srcName, parName).keys())
+    def store(self, like, srcName, parName, x, negLogLike=None):
+        """Record the current free parameter values of "like" as the
+        profile point at x."""
+        if negLogLike is None:
+            negLogLike = like()
+        profile = self._profile(srcName, parName)
+        profile[x] = (negLogLike, _freeParamValues(like))
+        profile.move_to_end(x)
+        if self.maxsize is not None and len(profile) > self.maxsize:
+            profile.popitem(last=False)
+    def _lookup(self, profile, x, rtol):
+        if x in profile or rtol <= 0:
+            return x
+        X = sorted(profile.keys())
+        i = bisect.bisect(X, x)
+        nearest = min(X[max(i-1, 0):i+1], key=lambda xx: abs(xx - x))
+        if abs(nearest - x) <= rtol*abs(x):
+            return nearest
+        return x
+    def restore(self, like, srcName, parName, x, rtol=0):
+        """If a profile point was stored at x (or within a relative
+        distance rtol of it), set the free parameters of "like" to it
+        and return its -log-likelihood.  Otherwise return None."""
+        profile = self._profile(srcName, parName)
+        if len(profile) == 0:
+            return None
+        key = self._lookup(profile, x, rtol)
+        entry = profile.get(key)
+        if entry is None:
+            return None
+        negLogLike, values = entry
+        if len(values) != len(_freeParamValues(like)):
+            return None
+        profile.move_to_end(key)
+        like.logLike.setFreeParamValues(list(values))
+        return negLogLike
+    def guess(self, like, srcName, parName, x):
+        """Set the free parameters of "like" by linear interpolation in
+        the cached profile points, or to the nearest point if x is
+        outside their range.  Returns False if there is nothing
+        suitable to start from."""
+        nfree = len(_freeParamValues(like))
+        profile = self._profile(srcName, parName)
+        X = sorted([xx for xx in profile if len(profile[xx][1]) == nfree])
+        if len(X) == 0:
+            return False
+        Y = num.array([profile[xx][1] for xx in X])
+        values = [float(num.interp(x, X, column)) for column in Y.T]
+        like.logLike.setFreeParamValues(values)
+        return True
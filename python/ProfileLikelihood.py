@@ -0,0 +1,64 @@
+"""
+@brief Memoized profile likelihood in one model parameter.
+"""
+# $Header$
+
+from ProfileCache import ProfileCache
+
+class ProfileLikelihood(object):
+    """Callable returning -log-likelihood with the parameter "parName"
+    of source "srcName" frozen at a given value and the remaining free
+    parameters optimized.  Results are kept in a ProfileCache: a value
+    already evaluated (or within a relative distance "rtol" of one) is
+    returned without calling the optimizer, and new points are
+    optimized starting from nuisance parameters interpolated from the
+    cached ones.  By default the cache holds the "maxsize" most
+    recently used points; a shared ProfileCache may be passed instead.
+
+    The parameter should already be frozen.  "optimize" is a function
+    called with no arguments to optimize the model; by default
+    like.optimize(verbosity) is called, with one retry on failure.
+    The "hits" and "misses" counters record how many calls were served
+    from the cache."""
+    def __init__(self, like, srcName, parName, cache=None, maxsize=128,
+                 rtol=0, optimize=None, verbosity=0):
+        self.like = like
+        self.srcName = srcName
+        self.parName = parName
+        self.indx = like.par_index(srcName, parName)
+        if cache is None:
+            cache = ProfileCache(maxsize)
+        self.cache = cache
+        self.rtol = rtol
+        self.verbosity = verbosity
+        if optimize is not None:
+            self._optimize = optimize
+        self.hits = 0
+        self.misses = 0
+    def __call__(self, x):
+        self.like[self.indx] = x
+        negLogLike = self.cache.restore(self.like, self.srcName,
+                                        self.parName, x, self.rtol)
+        if negLogLike is not None:
+            self.hits += 1
+            return negLogLike
+        self.misses += 1
+        self.cache.guess(self.like, self.srcName, self.parName, x)
+        self._optimize()
+        negLogLike = self.like()
+        self.cache.store(self.like, self.srcName, self.parName, x,
+                         negLogLike)
+        return negLogLike
+    def store(self, x, negLogLike=None):
+        """Add the current state of the model as the profile point at
+        x, e.g., the global best fit."""
+        self.cache.store(self.like, self.srcName, self.parName, x,
+                         negLogLike)
+    def _optimize(self):
+        try:
+            self.like.optimize(self.verbosity)
+        except RuntimeError:
+            self.like.optimize(self.verbosity)
+    def __repr__(self):
+        return ("ProfileLikelihood(%s, %s): %i hits, %i misses"
+                % (self.srcName, self.parName, self.hits, self.misses))
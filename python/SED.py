@@ -40,7 +40,11 @@ sed = SED(like,name,
           # By default, the energy binning is consistent with
           # the binning in the ft1 file. This can be modified, but the
           # new bins must line up with the ft1 file's bin edges
-          bin_edges = [1e2, 1e3, 1e4, 1e4])
+          bin_edges = [1e2, 1e3, 1e4, 1e4],
+
+          # The energy bins are independent and can be fit in
+          # parallel by this many worker processes
+          n_workers=8)
 
 # save data points to a file
 sed.save('sed_Vela.dat') 
@@ -63,16 +67,31 @@ Todo:
 
 $Header: /nfs/slac/g/glast/ground/cvs/pyLikelihood/python/SED.py,v 1.12 2015/07/18 21:56:59 cohen Exp $
 """
+import os
 from pprint import pformat
 
 import numpy as np
-from scipy.stats import chi2
-import pylab as P
 
-from pyLikelihood import ParameterVector, dArg
+from pyLikelihood import ParameterVector
 from LikelihoodState import LikelihoodState
 from UpperLimits import UpperLimits
 from IntegralUpperLimit import calc_int
+from FluxDensity import spectrumValues
+
+_worker_sed = None
+_worker_like = None
+_worker_state = None
+
+def _init_worker(sed, factory, srcModel, tol, tolType):
+    global _worker_sed, _worker_like, _worker_state
+    _worker_sed = sed
+    _worker_like = factory(srcModel)
+    _worker_like.tol = tol
+    _worker_like.setFitTolType(tolType)
+    _worker_state = LikelihoodState(_worker_like, compact=True)
+
+def _calculate_bin(i):
+    return _worker_sed._calculate_bin(_worker_like, i, _worker_state)
 
 class SED(object):
     """ Object to make SEDs using pyLikelihood. """
@@ -90,6 +109,8 @@ class SED(object):
                  min_ts=4,
                  ul_confidence=.95,
                  do_minos=True,
+                 n_workers=None,
+                 factory=None,
                 ):
         """ Parameters:
             * like - pyLikelihood object
@@ -110,6 +131,17 @@ class SED(object):
             * ul_confidence - confidence level for upper limit.
             * do_minos - set to True to compute asymetric errors with Minos; 
                          set to False for symetric MIGRAD error
+            * n_workers - if set, fit the energy bins in parallel in this
+                          many worker processes, each with its own copy of
+                          the analysis object.  Each bin then starts from
+                          the model as it was before the first bin, while
+                          the sequential loop starts each bin from the
+                          previous bin's fit, so the two can differ
+                          slightly when freeze_background is False.
+            * factory - function taking a source model xml file and
+                        returning the analysis object for a worker.
+                        Default is a BinnedAnalysis sharing the
+                        observation of like.
         """
         self.name               = name
         self.verbosity          = verbosity
@@ -121,6 +153,8 @@ class SED(object):
         self.min_ts             = min_ts
         self.ul_confidence      = ul_confidence
         self.do_minos           = do_minos
+        self.n_workers          = n_workers
+        self.factory            = factory
 
         self.spectrum = like.logLike.getSource(self.name).spectrum()
         self.nobs = like.nobs
@@ -180,6 +214,7 @@ class SED(object):
     def frequentist_upper_limit(like,name,emin,emax,confidence,verbosity):
         """ Calculate a frequentist upper limit on the prefactor. 
             Returns the unscaled prefactor upper limit. """
+        from scipy.stats import chi2
         delta_logl = chi2.ppf(2*confidence-1,1)/2.
         ul = UpperLimits(like)
         flux_ul, pref_ul = ul[name].compute(emin=emin, emax=emax, 
@@ -235,7 +270,7 @@ class SED(object):
 
         # make copy of parameter values + free parameters
         
-        saved_state = LikelihoodState(like)
+        saved_state = LikelihoodState(like, compact=True)
 
         if self.freeze_background:
             if verbosity: print ('Freezing all parameters')
@@ -254,71 +289,129 @@ class SED(object):
         index.setFree(False)
         like.syncSrcParams(name)
 
+        if self.n_workers is None:
+            for i in range(len(self.energy)):
+                self._calculate_bin(like, i)
+        else:
+            self._calculate_parallel(like)
+
+        self.significant=self.ts>=self.min_ts
+
+        # revert to old model
+        like.setEnergyRange(*init_energies)
+        like.setSpectrum(name,old_spectrum)
+        saved_state.restore()
+
+    # Per-bin quantities computed by _calculate_bin
+    _bin_fields = ('dnde', 'dnde_err', 'dnde_lower_err', 'dnde_upper_err',
+                   'dnde_ul', 'flux', 'flux_err', 'flux_ul', 'eflux',
+                   'eflux_err', 'eflux_ul', 'ts', 'npred')
+
+    def _calculate_parallel(self, like):
+        """ Fit the energy bins in a pool of forked worker processes and
+            merge the results. Each worker builds its analysis object once
+            from a snapshot of the (already modified) source model and
+            returns to that snapshot before each bin, so the results do
+            not depend on how the bins are shared among the workers. """
+        import tempfile
+        import multiprocessing
+        from ParallelSourceDriver import _analysis_factory
+        factory = self.factory
+        if factory is None:
+            factory = _analysis_factory(like)
+        nworkers = min(self.n_workers, len(self.energy))
+        fd, srcModel = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+        try:
+            like.logLike.writeXml(srcModel)
+            context = multiprocessing.get_context('fork')
+            pool = context.Pool(nworkers, _init_worker,
+                                (self, factory, srcModel, like.tol,
+                                 like.tolType))
+            try:
+                rows = pool.map(_calculate_bin, range(len(self.energy)),
+                                chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            os.remove(srcModel)
+        for i, row in enumerate(rows):
+            for field, value in zip(SED._bin_fields, row):
+                getattr(self, field)[i] = value
+
+    def _calculate_bin(self, like, i, state=None):
+        """ Fit the source in energy bin i, which must already be a
+            PowerLaw of fixed index. Fills in element i of the result
+            arrays and returns those values in the order of _bin_fields.
+            If given, the LikelihoodState "state" is restored first, so
+            that each bin starts from the same model whatever bins were
+            fit before it. """
+
+        if state is not None:
+            state.restore()
+
+        name    = self.name
+        verbosity = self.verbosity
+        e, lower, upper = self.energy[i], self.lower_energy[i], self.upper_energy[i]
+
         # assume a canonical dnde=1e-11 at 1GeV index 2 starting value
-        dnde_start = 1e-11*(self.energy/1e3)**(-2)
+        dnde_start = 1e-11*(e/1e3)**(-2)
 
         optverbosity = max(verbosity-1, 0) # see IntegralUpperLimit.py
 
-        for i,(e,lower,upper) in enumerate(zip(self.energy,self.lower_energy,self.upper_energy)):
+        if verbosity: print ('Calculating spectrum from %.0dMeV to %.0dMeV' % (lower,upper))
 
-            if verbosity: print ('Calculating spectrum from %.0dMeV to %.0dMeV' % (lower,upper))
+        # goot starting guess for source
+        prefactor=like[like.par_index(name, 'Prefactor')]
+        prefactor.setScale(dnde_start)
+        prefactor.setValue(1)
+        prefactor.setBounds(1e-10,1e10)
 
-            # goot starting guess for source
-            prefactor=like[like.par_index(name, 'Prefactor')]
-            prefactor.setScale(dnde_start[i])
-            prefactor.setValue(1)
-            prefactor.setBounds(1e-10,1e10)
+        scale=like[like.par_index(name, 'Scale')]
+        scale.setScale(1)
+        scale.setValue(e)
+        like.syncSrcParams(name)
 
-            scale=like[like.par_index(name, 'Scale')]
-            scale.setScale(1)
-            scale.setValue(e)
-            like.syncSrcParams(name)
+        like.setEnergyRange(float(lower)+1, float(upper)-1)
 
-            like.setEnergyRange(float(lower)+1, float(upper)-1)
+        try:
+            like.fit(optverbosity,covar=True)
+        except Exception as ex:
+            if verbosity: print ('ERROR gtlike fit: ', ex)
 
-            try:
-                like.fit(optverbosity,covar=True)
-            except Exception as ex:
-                if verbosity: print ('ERROR gtlike fit: ', ex)
-
-            self.ts[i]=like.Ts(name,reoptimize=self.reoptimize_ts)
-
-            prefactor=like[like.par_index(name, 'Prefactor')]
-            self.dnde[i] = prefactor.getTrueValue()
-
-            if self.do_minos:
-                if verbosity: print ('Calculating minos errors from %.0dMeV to %.0dMeV' % (lower,upper))
-                self.dnde_lower_err[i], self.dnde_upper_err[i] = like.minosError(name, 'Prefactor')
-                self.dnde_lower_err[i]*=(-1)*prefactor.getScale() # make lower errors positive
-                self.dnde_upper_err[i]*=prefactor.getScale()
-                self.dnde_err[i] = (self.dnde_upper_err[i] + self.dnde_lower_err[i])/2
-            else:
-                self.dnde_err[i] = prefactor.parameter.error() * prefactor.parameter.getScale()
-
-            self.flux[i] = like.flux(name, lower, upper)
-            self.flux_err[i] = like.fluxError(name, lower, upper)
-
-            self.eflux[i] = like.energyFluxError(name, lower, upper)
-            self.eflux_err[i] = like.energyFluxError(name, lower, upper)
-
-            if self.ts[i] < self.min_ts or self.always_upper_limit: 
-                if verbosity: print ('Calculating upper limit from %.0dMeV to %.0dMeV' % (lower,upper))
-                self.dnde_ul[i], self.flux_ul[i], self.eflux_ul[i] = SED.upper_limit(like,name,self.ul_algorithm,lower,upper,
-                                                                                     confidence=self.ul_confidence,
-                                                                                     verbosity=verbosity)
-
-            if verbosity:
-                print (lower,upper,self.dnde[i],self.dnde_err[i],self.ts[i],self.dnde_ul[i])
-            
-            self.npred[i] = like.NpredValue(name)
+        self.ts[i]=like.Ts(name,reoptimize=self.reoptimize_ts)
 
+        prefactor=like[like.par_index(name, 'Prefactor')]
+        self.dnde[i] = prefactor.getTrueValue()
+
+        if self.do_minos:
+            if verbosity: print ('Calculating minos errors from %.0dMeV to %.0dMeV' % (lower,upper))
+            self.dnde_lower_err[i], self.dnde_upper_err[i] = like.minosError(name, 'Prefactor')
+            self.dnde_lower_err[i]*=(-1)*prefactor.getScale() # make lower errors positive
+            self.dnde_upper_err[i]*=prefactor.getScale()
+            self.dnde_err[i] = (self.dnde_upper_err[i] + self.dnde_lower_err[i])/2
+        else:
+            self.dnde_err[i] = prefactor.parameter.error() * prefactor.parameter.getScale()
 
-        self.significant=self.ts>=self.min_ts
+        self.flux[i] = like.flux(name, lower, upper)
+        self.flux_err[i] = like.fluxError(name, lower, upper)
 
-        # revert to old model
-        like.setEnergyRange(*init_energies)
-        like.setSpectrum(name,old_spectrum)
-        saved_state.restore()
+        self.eflux[i] = like.energyFluxError(name, lower, upper)
+        self.eflux_err[i] = like.energyFluxError(name, lower, upper)
+
+        if self.ts[i] < self.min_ts or self.always_upper_limit: 
+            if verbosity: print ('Calculating upper limit from %.0dMeV to %.0dMeV' % (lower,upper))
+            self.dnde_ul[i], self.flux_ul[i], self.eflux_ul[i] = SED.upper_limit(like,name,self.ul_algorithm,lower,upper,
+                                                                                 confidence=self.ul_confidence,
+                                                                                 verbosity=verbosity)
+
+        if verbosity:
+            print (lower,upper,self.dnde[i],self.dnde_err[i],self.ts[i],self.dnde_ul[i])
+        
+        self.npred[i] = like.NpredValue(name)
+
+        return tuple(getattr(self, field)[i] for field in SED._bin_fields)
 
     def todict(self):
         """ Pacakge up the results of the SED fit into
@@ -383,7 +476,7 @@ class SED(object):
     @staticmethod
     def get_dnde(spectrum,energies):
         """ Returns the spectrum in units of ph/cm^2/s/MeV. """
-        return np.asarray([spectrum(dArg(i)) for i in energies])
+        return spectrumValues(spectrum, energies)
     @staticmethod 
     def plot_spectrum(axes,spectrum, npts=100, **kwargs):
         """ This function overlays a pyLikelihood spectrum
@@ -461,6 +554,7 @@ class SED(object):
              data_kwargs=dict(),
              spectral_kwargs=dict(color='red',zorder=1.9)):
         """ Plot the SED using matpotlib. """
+        import pylab as P
 
         if axes is None:
             fig = P.figure(fignum,figsize)
@@ -10,11 +10,9 @@ import os
 import glob
 import numpy as num
 import pyLikelihood as pyLike
-from SrcModel import SourceModel
+from SrcModel import SourceModel, funcFactory
 from SimpleDialog import SimpleDialog, Param 
 
-_funcFactory = pyLike.SourceFactory.funcFactory()
-
 def _resolveFileList(files):
     fileList = files.split(',')
     my_list = []
@@ -112,7 +110,7 @@ class SrcAnalysis(object):
         self.optimizer = optimizer
         self.events = self.observation.eventCont().events();
         self.logLike = pyLike.LogLike(self.observation())
-        self.logLike.readXml(srcModel, _funcFactory)
+        self.logLike.readXml(srcModel, funcFactory())
         self.logLike.computeEventResponses()
         self.model = SourceModel(self.logLike)
         eMin, eMax = self.observation.roiCuts().getEnergyCuts()
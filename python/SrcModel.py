@@ -7,10 +7,29 @@ SourceModel interface to allow for manipulation of fit parameters.
 # $Header: /nfs/slac/g/glast/ground/cvs/pyLikelihood/python/SrcModel.py,v 1.12 2016/10/13 02:10:40 echarles Exp $
 #
 import sys
+import time
 from xml.dom import minidom
 import pyLikelihood as pyLike
 
-_app_helper = pyLike.AppHelpers()
+_funcFactory = None
+
+def funcFactory(verbosity=0):
+    """Return the optimizers::FunctionFactory with all of the
+    Likelihood function prototypes.  It is created on the first call and
+    shared by every analysis object in the process; the time taken to
+    create it is stored as funcFactory.creation_time and printed if
+    verbosity > 0."""
+    global _funcFactory
+    if _funcFactory is None:
+        t0 = time.time()
+        _funcFactory = pyLike.SourceFactory.funcFactory()
+        funcFactory.creation_time = time.time() - t0
+        if verbosity > 0:
+            print ("Created function factory in %.3f s"
+                   % funcFactory.creation_time)
+    return _funcFactory
+
+funcFactory.creation_time = None
 
 def ids(istart=0):
     i = istart - 1
@@ -26,21 +45,63 @@ class SourceModel(object):
             self._addXmlAttributes(xmlFile)
     def delete(self, source):
         src = self.logLike.deleteSource(source)
-        self._loadSources()
+        self.remove_source(source)
         return src
     def add(self, source):
         try:
             print ("adding ", source.getName())
             self.logLike.addSource(source)
-            self._loadSources()
+            self.insert_source(source.getName())
         except:
             pass
+    def insert_source(self, srcName):
+        """Wrap a source that has been added to (or whose spectrum has
+        been replaced in) the logLike object, leaving the wrappers of
+        the other sources untouched.  Extra attributes of an existing
+        wrapper for srcName are carried over."""
+        old_source = self.srcs.get(srcName)
+        self.srcs[srcName] = Source(self.logLike.getSource(srcName))
+        if old_source is not None:
+            for key, value in old_source.__dict__.items():
+                if key not in ('funcs', 'src', 'is_modified'):
+                    self.srcs[srcName].__dict__[key] = value
+        self.update()
+    def remove_source(self, srcName):
+        "Drop the wrapper of a source deleted from the logLike object."
+        self.srcs.pop(srcName, None)
+        self.update()
+    def update(self):
+        """Bring the source list in line with the logLike object,
+        wrapping only sources that are new and dropping those that are
+        gone, then renumber the parameters."""
+        srcNames = pyLike.StringVector()
+        self.logLike.getSrcNames(srcNames)
+        self.srcNames = tuple(srcNames)
+        for name in self.srcNames:
+            if name not in self.srcs:
+                self.srcs[name] = Source(self.logLike.getSource(name))
+        for name in list(self.srcs.keys()):
+            if name not in self.srcNames:
+                del self.srcs[name]
+        self._walk()
+    def setErrors(self, errors):
+        "Set the errors of the free parameters in place."
+        j = 0
+        for par in self.params:
+            if par.isFree():
+                par.setError(errors[j])
+                j += 1
     def syncParams(self):
         "Loop through sources and synchronize the parameters if necessary."
         for source_name, source in self.srcs.items():
             if source.is_modified:
                 self.logLike.syncSrcParams(source_name)
                 source.is_modified = False
+    def syncSrcParams(self, srcName):
+        "Synchronize the parameters of srcName and clear its modified flag."
+        self.logLike.syncSrcParams(srcName)
+        if srcName in self.srcs:
+            self.srcs[srcName].is_modified = False
     def _loadSources(self):
         srcNames = pyLike.StringVector()
         self.logLike.getSrcNames(srcNames)
@@ -74,14 +135,25 @@ class SourceModel(object):
     def _walk(self):
         indx = ids()
         self.params = []
+        self._parIndices = {}
         for srcName in self.srcNames:
             src = self[srcName]
             for funcName in src.funcs:
                 if funcName == "Spectrum":
                     func = src.funcs[funcName]
+                    func.clearParIds()
                     for param in func.paramNames:
+                        par_id = next(indx)
                         self.params.append(func.getParam(param))
-                        src.funcs[funcName].appendParId(next(indx))
+                        src.funcs[funcName].appendParId(par_id)
+                        self._parIndices[(srcName, param)] = par_id
+    def par_index(self, srcName, parName):
+        "Index of the parameter parName of source srcName in self.params."
+        try:
+            return self._parIndices[(srcName, parName)]
+        except KeyError:
+            raise RuntimeError("Parameter %s for source %s not found."
+                               % (parName, srcName))
     def __setitem__(self, indx, value):
         self.params[indx].setValue(value)
         self.params[indx].setError(0)
@@ -239,6 +311,8 @@ class Function(object):
         return self.params[name]
     def appendParId(self, indx):
         self._parIds.append(indx)
+    def clearParIds(self):
+        self._parIds = []
     def __repr__(self, prefix='', free_only=False):
         lines = []
         for indx, parName in zip(self._parIds, self.paramNames):
@@ -271,13 +345,32 @@ class Parameter(object):
     def setScale(self, scale):
         self.parameter.setScale(scale)
         self.source_obj.is_modified = True
+    def setValue(self, value):
+        self.parameter.setValue(value)
+        self.source_obj.is_modified = True
+    def setTrueValue(self, value):
+        self.parameter.setTrueValue(value)
+        self.source_obj.is_modified = True
+    def setAlwaysFixed(self, alwaysFixed):
+        self.parameter.setAlwaysFixed(alwaysFixed)
+        self.source_obj.is_modified = True
+    def setBounds(self, *args):
+        "Accepts (minValue, maxValue) or a single (minValue, maxValue) pair."
+        self.parameter.setBounds(*args)
+        self.source_obj.is_modified = True
+    def setEquals(self, rhs):
+        self.parameter.setEquals(rhs)
+        self.source_obj.is_modified = True
+    def setDataValues(self, rhs):
+        self.parameter.setDataValues(rhs)
+        self.source_obj.is_modified = True
     def value(self):
         return self.parameter.getValue()
     def addPrior(self, funcname):
         if self.parameter.log_prior() is not None:
             raise RuntimeError("Prior for parameter %s already applied"
                                % self.parameter.getName())
-        func = _app_helper.funcFactory().create(funcname)
+        func = funcFactory().create(funcname)
         self.parameter.setPrior(func)
     def setPriorParams(self, **kwds):
         prior = self.parameter.log_prior()
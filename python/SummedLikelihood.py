@@ -9,15 +9,25 @@ classes.
 # $Header: /nfs/slac/g/glast/ground/cvs/pyLikelihood/python/SummedLikelihood.py,v 1.26 2016/09/15 21:27:41 echarles Exp $
 #
 
+import numpy as num
 import pyLikelihood as pyLike
-from SrcModel import SourceModel
 from LikelihoodState import LikelihoodState
 from AnalysisBase import AnalysisBase
 
 class Parameter(object):
-    "Composite parameter object."
-    def __init__(self, pars=[]):
+    """Composite parameter object.  The setters flag the "sources"
+    (SrcModel.Source objects of the components) as modified, for
+    parameters that do not do so themselves, e.g., normPar()."""
+    def __init__(self, pars=None, sources=None):
+        if pars is None:
+            pars = []
+        if sources is None:
+            sources = []
         self.pars = pars
+        self.sources = sources
+    def _setModified(self):
+        for source in self.sources:
+            source.is_modified = True
     def addParam(self, par):
         self.pars.append(par)
     def value(self):
@@ -37,41 +47,66 @@ class Parameter(object):
     def setFree(self, flag):
         for par in self.pars:
             par.setFree(flag)
+        self._setModified()
     def setValue(self, value):
         for par in self.pars:
             par.setValue(value)
+        self._setModified()
+    def setTrueValue(self, value):
+        for par in self.pars:
+            par.setTrueValue(value)
+        self._setModified()
     def setError(self, error):
         for par in self.pars:
             par.setError(error)
     def setBounds(self, minValue, maxValue):
         for par in self.pars:
             par.setBounds(minValue, maxValue)
+        self._setModified()
     def setScale(self, scale):
         for par in self.pars:
             par.setScale(scale)
+        self._setModified()
     def setAlwaysFixed(self, alwaysFixed):
         for par in self.pars:
             par.setAlwaysFixed(alwaysFixed)
+        self._setModified()
     def setEquals(self, rhs):
         for par in self.pars:
             par.setEquals(rhs)
+        self._setModified()
     def __getattr__(self, attrname):
         return getattr(self.pars[0], attrname)
 
 class SummedLikelihood(AnalysisBase):
-    def __init__(self, optimizer='Minuit'):
-        self.composite = pyLike.SummedLikelihood()
+    """Joint likelihood of several analysis objects sharing the same
+    source model.  With n_threads > 1, the components' values and
+    derivatives are computed concurrently in up to n_threads threads
+    (one component per thread at a time) for every evaluation made by
+    the optimizers.  This assumes that the components share no mutable
+    state, which the Likelihood library does not guarantee; check a
+    given setup against the serial evaluation with
+    SummedLikelihoodBenchmark.compareThreaded first."""
+    def __init__(self, optimizer='Minuit', n_threads=None):
+        if n_threads is None:
+            self.composite = pyLike.SummedLikelihood()
+        else:
+            self.composite = pyLike.ThreadedSummedLikelihood(n_threads)
+        self.n_threads = n_threads
         #the C++ SummedLikelihood has many if not all the properties
         #of a logLike object
         self.logLike = self.composite
         self.components = []
         self.covariance = None
+        self._covarianceView = None
         self.covar_is_current = False
         self.optObject = None
         self.optimizer = optimizer
         self.tolType = pyLike.ABSOLUTE
         self.tol = 1e-2
         self.saved_state = None
+        self._params = []
+        self._paramLists = []
     def sourceNames(self):
         return self.components[0].sourceNames()
     def addComponent(self, like):
@@ -79,14 +114,38 @@ class SummedLikelihood(AnalysisBase):
         self.components.append(like)
         if len(self.components) == 1:
             self.model = self.components[0].model
-    def syncSrcParams(self, src=None):
+        self._addParams(like)
+    def _addParams(self, like):
+        pars = like.params()
+        if not self._paramLists:
+            self._params = [Parameter([par]) for par in pars]
+        else:
+            for composite, par in zip(self._params, pars):
+                composite.addParam(par)
+        self._paramLists.append(pars)
+    def _rebuildParams(self):
+        self._params = []
+        self._paramLists = []
+        for like in self.components:
+            self._addParams(like)
+    def syncSrcParams(self, src=None, modifiedOnly=False):
+        """Synchronize the parameters of source "src" (default all
+        sources) in every component.  With modifiedOnly=True, only the
+        sources flagged as modified by the python parameter wrappers are
+        synchronized, and their flags are cleared; Ts and the fitting
+        methods do this.  Call syncSrcParams() after setting parameters
+        directly through the pyLikelihood objects, which do not set the
+        flags."""
         if src is not None:
             for comp in self.components:
-                comp.logLike.syncSrcParams(src)
+                comp.model.syncSrcParams(src)
+        elif modifiedOnly:
+            for comp in self.components:
+                comp.model.syncParams()
         else:
             for comp in self.components:
                 for src in self.sourceNames():
-                    comp.logLike.syncSrcParams(src)
+                    comp.model.syncSrcParams(src)
     def fit(self, verbosity=3, tol=None, optimizer=None,
             covar=False, optObject=None, numericDerivs=False):
         if tol is None:
@@ -107,7 +166,8 @@ class SummedLikelihood(AnalysisBase):
         myOpt.find_min_only(verbosity, tol, self.tolType)
         self.saveBestFit()
     def normPar(self, source):
-        return Parameter([like.normPar(source) for like in self.components])
+        return Parameter([like.normPar(source) for like in self.components],
+                         [like.model.srcs[source] for like in self.components])
     def __call__(self):
         negLogLike = -self.composite.value()
         self.saveBestFit(negLogLike)
@@ -115,14 +175,16 @@ class SummedLikelihood(AnalysisBase):
     def sourceNames(self):
         return self.components[0].sourceNames()
     def params(self):
-        my_params = []
-        for i, like in enumerate(self.components):
-            for j, par in enumerate(like.params()):
-                if i == 0:
-                    my_params.append(Parameter([par]))
-                else:
-                    my_params[j].addParam(par)
-        return my_params
+        """Composite parameters tying together the corresponding
+        parameters of all of the components.  The table is built as the
+        components are added and is rebuilt only when the parameter list
+        of a component has been replaced, i.e., after a source has been
+        added or deleted or has been given a new spectrum."""
+        for like, pars in zip(self.components, self._paramLists):
+            if like.params() is not pars:
+                self._rebuildParams()
+                break
+        return self._params
 
     def nFreeParams(self):        
         '''Count the number of free parameters in the active model.'''
@@ -154,9 +216,10 @@ class SummedLikelihood(AnalysisBase):
     def __repr__(self):
         return str(self.components[0].model)
     def _syncParams(self):
-        for component in self.components:
-            component.logLike.syncParams()
+        self.syncSrcParams(modifiedOnly=True)
     def __getitem__(self, name):
+        if isinstance(name, int):
+            return self.params()[name]
         item = self.model[name]
         try:
             item.type
@@ -169,7 +232,6 @@ class SummedLikelihood(AnalysisBase):
     def __setitem__(self, name, value):
         for component in self.components:
             component[name] = value
-            component.syncSrcParams(self.model[name].srcName)
     def thaw(self, i):
         for component in self.components:
             component.thaw(i)
@@ -203,13 +265,10 @@ class SummedLikelihood(AnalysisBase):
         self._set_errors(errors)
         return errors
     def _set_errors(self, errors):
-        source_attributes = self.components[0].getExtraSourceAttributes()
+        # The component SourceModels wrap the C++ parameters directly,
+        # so they pick up the new errors without being rebuilt.
         my_errors = list(errors)
         self.composite.setErrors(my_errors)
-        for component in self.components:
-            component.model = SourceModel(component.logLike)
-            for src in source_attributes:
-                component.model[src].__dict__.update(source_attributes[src])
     def minosError(self, srcname, parname, level=1):
         freeParams = pyLike.ParameterVector()
         self.composite.getFreeParams(freeParams)
@@ -231,8 +290,7 @@ class SummedLikelihood(AnalysisBase):
            tol=None, MaxIterations=10, verbosity=0):
         if verbosity > 0:
             print ("*** Start Ts_dl ***")
-        source_attributes = self.components[0].getExtraSourceAttributes()
-        self.syncSrcParams()
+        self.syncSrcParams(modifiedOnly=True)
         freeParams = pyLike.DoubleVector()
         self.components[0].logLike.getFreeParamValues(freeParams)
         # Get the number of free parameters in the baseline mode
@@ -243,7 +301,8 @@ class SummedLikelihood(AnalysisBase):
         logLike1 = -self()
         self._ts_src = []
         for comp in self.components:
-            comp._ts_src = comp.logLike.deleteSource(srcName) 
+            comp._checkMapViews(srcName)
+            comp._ts_src = comp.logLike.deleteSource(srcName)
             self._ts_src.append(comp._ts_src)
         logLike0 = -self()
         if tol is None:
@@ -270,17 +329,50 @@ class SummedLikelihood(AnalysisBase):
                     self._renorm()
                 except ZeroDivisionError:
                     pass
-        self.syncSrcParams()
+        self.syncSrcParams(modifiedOnly=True)
         logLike0 = max(-self(), logLike0)
         Ts_value = 2*(logLike1 - logLike0)
         for ts_src, comp in zip(self._ts_src, self.components):
             comp.logLike.addSource(ts_src)
             comp.logLike.setFreeParamValues(freeParams)
-            comp.model = SourceModel(comp.logLike)
-            for src in source_attributes:
-                comp.model[src].__dict__.update(source_attributes[src])
+            comp.model.insert_source(srcName)
         self.model = self.components[0].model
         return Ts_value
+    def TsAll(self, srcNames=None, reoptimize=False, approx=True,
+              tol=None, MaxIterations=10, verbosity=0):
+        """As AnalysisBase.TsAll, with each null hypothesis formed in
+        every component."""
+        if srcNames is None:
+            srcNames = self.sourceNames()
+        if tol is None:
+            tol = self.tol
+        saved_state = LikelihoodState(self, compact=True)
+        self.syncSrcParams(modifiedOnly=True)
+        logLike1 = self.composite.value()
+        n_free_test = self.nFreeParams()
+        ts_values = num.zeros(len(srcNames))
+        for i, srcName in enumerate(srcNames):
+            if verbosity > 0:
+                print ("*** Ts for %s ***" % srcName)
+            for comp in self.components:
+                comp._ts_src = comp.logLike.getSource(srcName)
+            srcPars = self.freePars(srcName)
+            n_free_base = n_free_test - len(srcPars)
+            self.setFreeFlag(srcName, srcPars, False)
+            normPar = self.normPar(srcName)
+            normPar.setBounds(0, normPar.getBounds()[1])
+            normPar.setValue(0)
+            self.syncSrcParams(srcName)
+            logLike0 = self.composite.value()
+            self._fitNullHypothesis(n_free_base, reoptimize, approx, tol,
+                                    MaxIterations, verbosity)
+            self.syncSrcParams(modifiedOnly=True)
+            logLike0 = max(self.composite.value(), logLike0)
+            ts_values[i] = 2*(logLike1 - logLike0)
+            saved_state.restore()
+        return ts_values
+    def _scanComponents(self):
+        return self.components
     def _renorm(self, factor=None):
         if factor is None:
             freeNpred, totalNpred = self._npredValues()
@@ -0,0 +1,126 @@
+"""
+@brief Checks of the threaded evaluation of SummedLikelihood and of
+DistributedSummedLikelihood against the serial SummedLikelihood:
+agreement of the values, derivatives and fit results, and the
+evaluation and fit times.
+"""
+# $Header$
+
+import time
+import numpy as num
+import pyLikelihood as pyLike
+from SummedLikelihood import SummedLikelihood
+from DistributedSummedLikelihood import DistributedSummedLikelihood
+
+def _freeDerivs(logLike):
+    derivs = pyLike.DoubleVector()
+    logLike.getFreeDerivs(derivs)
+    return num.array(derivs)
+
+def _freeParamValues(logLike):
+    values = pyLike.DoubleVector()
+    logLike.getFreeParamValues(values)
+    return num.array(values)
+
+def compareThreaded(makeComponents, n_threads=(2, 4, 8, 16),
+                    optimizer='Minuit', repeat=10, rtol=1e-10,
+                    fitTol=1e-3):
+    """Build a SummedLikelihood from the analysis objects returned by
+    makeComponents() without threads, and then with each number of
+    threads in n_threads.  makeComponents is called once for each of
+    them, so every fit starts from the same parameter values.
+
+    The value and the free derivatives at the starting point must
+    match the serial ones to within rtol, and the fitted
+    -log-likelihood to within fitTol; a RuntimeError is raised
+    otherwise.  The optimizers must also have gone through the
+    threaded value() and getFreeDerivs() (numEvaluations() > 0).
+
+    Returns a list of (n_threads, evaluation time, fit time,
+    -log-likelihood) tuples, the first one for the serial
+    SummedLikelihood, and prints the speed-up of each configuration."""
+    results = []
+    reference = None
+    for nthreads in (None,) + tuple(n_threads):
+        like = SummedLikelihood(optimizer=optimizer, n_threads=nthreads)
+        for component in makeComponents():
+            like.addComponent(component)
+        value = like.logLike.value()
+        derivs = _freeDerivs(like.logLike)
+        t0 = time.time()
+        for i in range(repeat):
+            like.logLike.value()
+            _freeDerivs(like.logLike)
+        evalTime = (time.time() - t0)/repeat
+        if nthreads is not None:
+            like.logLike.resetNumEvaluations()
+        t0 = time.time()
+        negLogLike = like.fit(verbosity=0)
+        fitTime = time.time() - t0
+        if reference is None:
+            reference = value, derivs, negLogLike
+        else:
+            if (not num.allclose(value, reference[0], rtol=rtol, atol=0) or
+                not num.allclose(derivs, reference[1], rtol=rtol,
+                                 atol=rtol*num.abs(reference[1]).max())):
+                raise RuntimeError("n_threads = %i: value or derivatives "
+                                   % nthreads + "differ from "
+                                   "SummedLikelihood.")
+            if abs(negLogLike - reference[2]) > fitTol:
+                raise RuntimeError("n_threads = %i: fitted -log-likelihood "
+                                   % nthreads + "%.6f differs from %.6f."
+                                   % (negLogLike, reference[2]))
+            if like.logLike.numEvaluations() == 0:
+                raise RuntimeError("The optimizer did not call the "
+                                   "threaded value() or getFreeDerivs().")
+        results.append((nthreads, evalTime, fitTime, negLogLike))
+    print ("%10s %12s %8s %10s %8s %14s" % ('n_threads', 'eval (s)',
+                                            'speed-up', 'fit (s)',
+                                            'speed-up', '-logLike'))
+    for nthreads, evalTime, fitTime, negLogLike in results:
+        print ("%10s %12.4g %8.2f %10.4g %8.2f %14.6f"
+               % (nthreads, evalTime, results[0][1]/evalTime, fitTime,
+                  results[0][2]/fitTime, negLogLike))
+    return results
+
+def compareDistributed(makeComponents, optimizer='Minuit', fitTol=1e-3,
+                       parTol=1e-3):
+    """Fit the analysis objects returned by makeComponents() with
+    SummedLikelihood and, from a second set, with
+    DistributedSummedLikelihood, whose optimizers run on a
+    CallbackStatistic.  The fitted -log-likelihoods must agree to
+    within fitTol, and the free parameter values and their errors to
+    within parTol times the errors; a RuntimeError is raised otherwise.
+
+    Returns the two fit times and prints them."""
+    like = SummedLikelihood(optimizer=optimizer)
+    for component in makeComponents():
+        like.addComponent(component)
+    t0 = time.time()
+    negLogLike = like.fit(verbosity=0)
+    summedTime = time.time() - t0
+    values = _freeParamValues(like.logLike)
+    errors = num.array([par.error() for par in like.params()
+                        if par.isFree()])
+    with DistributedSummedLikelihood(optimizer=optimizer) as dlike:
+        for component in makeComponents():
+            dlike.addComponent(component)
+        t0 = time.time()
+        dNegLogLike = dlike.fit(verbosity=0)
+        distributedTime = time.time() - t0
+        dValues = num.array(dlike.freeParamValues())
+        dErrors = num.array([par.error() for par in dlike.params()
+                             if par.isFree()])
+    if abs(dNegLogLike - negLogLike) > fitTol:
+        raise RuntimeError("Fitted -log-likelihood %.6f differs from the "
+                           "SummedLikelihood value %.6f."
+                           % (dNegLogLike, negLogLike))
+    if (len(dValues) != len(values) or
+        num.any(num.abs(dValues - values) > parTol*errors) or
+        num.any(num.abs(dErrors - errors) > parTol*errors)):
+        raise RuntimeError("Fitted parameters or errors differ from the "
+                           "SummedLikelihood fit.")
+    print ("SummedLikelihood fit: %.4g s, DistributedSummedLikelihood "
+           "fit: %.4g s, -logLike %.6f" % (summedTime, distributedTime,
+                                           negLogLike))
+    return summedTime, distributedTime
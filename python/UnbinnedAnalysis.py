@@ -9,16 +9,16 @@ Python interface for unbinned likelihood
 
 import sys
 import glob
+import time
 import pyLikelihood as pyLike
-from SrcModel import SourceModel
+from SrcModel import SourceModel, funcFactory
+from EventResponseCache import EventResponseCache
 from AnalysisBase import AnalysisBase, _quotefn, _null_file, num
 try:
     from tkinter.simpledialog import SimpleDialog, map, Param
 except ImportError as message:
     pass
 
-_funcFactory = pyLike._pyLikelihood.SourceFactory_funcFactory()
-
 def _resolveFileList(files):
     fileList = files.split(',')
     my_list = []
@@ -26,20 +26,53 @@ def _resolveFileList(files):
         my_list.extend(glob.glob(file.strip()))
     return my_list
 
+class _CutsCache(object):
+    """The DSS keyword cuts of a list of event files, read once for the
+    file-to-file comparison, the exposure cube check and the CALDB irfs
+    lookup.  As in AppHelpers.checkCuts, the per-file cuts skip the
+    time-range and event-class cuts, so files covering different time
+    ranges can be compared; the merged cuts keep them for the checks
+    against the exposure cube.  AppHelpers.checkExpMapCuts and
+    RoiCuts.readCuts only take file names, so they still read the
+    headers themselves."""
+    def __init__(self, eventFiles, extension='EVENTS'):
+        self.eventFiles = eventFiles
+        self.extension = extension
+        self._cuts = {}
+        self._merged = None
+    def cuts(self, eventFile):
+        if eventFile not in self._cuts:
+            self._cuts[eventFile] = pyLike.Cuts(eventFile, self.extension,
+                                                False, True, True)
+        return self._cuts[eventFile]
+    def merged(self):
+        """Cuts of all the files, with their GTIs merged."""
+        if self._merged is None:
+            self._merged = pyLike.Cuts(self.eventFiles, self.extension, False)
+        return self._merged
+
 class UnbinnedObs(object):
     def __init__(self, eventFile=None, scFile=None, expMap=None,
-                 expCube=None, irfs=None, checkCuts=True, sctable='SC_DATA'):
+                 expCube=None, irfs=None, checkCuts=True, sctable='SC_DATA',
+                 verbosity=0):
+        """The number of events read from each event file and the time
+        taken are kept in readStats and printed if verbosity > 0."""
         self.sctable = sctable
         self.checkCuts = checkCuts
+        self.verbosity = verbosity
+        self.readStats = []
         if eventFile is None and scFile is None:
             eventFile, scFile, expMap, expCube, irfs = self._obsDialog()
+        self._cutsCache = None
+        if eventFile is not None:
+            self._cutsCache = _CutsCache(self._fileList(eventFile))
         if checkCuts:
             self._checkCuts(eventFile, expMap, expCube)
         self.expMap = expMap
         self.expCube = expCube
         if irfs is None or irfs == 'CALDB':
             evfiles = self._fileList(eventFile)
-            my_cuts = pyLike.Cuts(evfiles[0], "EVENTS", False, True, True)
+            my_cuts = self._cutsCache.cuts(evfiles[0])
             self.irfs = my_cuts.CALDB_implied_irfs()
         else:
             self.irfs = irfs
@@ -70,15 +103,19 @@ class UnbinnedObs(object):
     def _checkCuts(self, eventFile, expMap=None, expCube=None):
         if eventFile is not None:
             eventFiles = self._fileList(eventFile)
-            checkCuts = pyLike.AppHelpers.checkCuts
             checkTimeCuts = pyLike.AppHelpers.checkTimeCuts
             checkExpMapCuts = pyLike.AppHelpers.checkExpMapCuts
+            cuts0 = self._cutsCache.cuts(eventFiles[0])
             for file in eventFiles[1:]:
-                checkCuts(eventFiles[0], 'EVENTS', file, 'EVENTS', False)
+                if not cuts0.compareWithoutGtis(self._cutsCache.cuts(file)):
+                    raise RuntimeError("DSS keywords in " + eventFiles[0]
+                                       + " do not match those in " + file)
             if expMap is not None and expMap != '':
                 checkExpMapCuts(eventFiles, expMap)
             if expCube is not None and expCube != '':
-                checkTimeCuts(eventFiles, 'EVENTS', expCube, 'Exposure')
+                expCubeCuts = pyLike.Cuts(expCube, 'Exposure', False)
+                checkTimeCuts(self._cutsCache.merged(), eventFiles[0],
+                              expCubeCuts, expCube)
     def _obsDialog(self):
         paramDict = MyOrderedDict()
         paramDict['eventFile'] = Param('file', '*.fits')
@@ -101,6 +138,8 @@ class UnbinnedObs(object):
         else:
             return files
     def _readData(self, scFile, eventFile):
+        if eventFile is not None:
+            self._roiCuts.readCuts(self._fileList(eventFile), 'EVENTS', False)
         self._readScData(scFile, eventFile)
         self._readEvents(eventFile)
         if self.expCube is not None and self.expCube != "":
@@ -109,14 +148,21 @@ class UnbinnedObs(object):
     def _readEvents(self, eventFile):
         if eventFile is not None:
             eventFiles = self._fileList(eventFile)
-            self._roiCuts.readCuts(eventFiles, 'EVENTS', False)
             for file in eventFiles:
+                t0 = time.time()
+                nevents = self._eventCont.events().size()
                 self._eventCont.getEvents(file)
+                self._fileRead(file,
+                               self._eventCont.events().size() - nevents,
+                               time.time() - t0)
             self.eventFiles = eventFiles
+    def _fileRead(self, file, nevents, dt):
+        self.readStats.append((file, nevents, dt))
+        if self.verbosity > 0:
+            rate = nevents/dt if dt > 0 else 0
+            print ("%s: %i events in %.2f s (%.0f events/s)"
+                   % (file, nevents, dt, rate))
     def _readScData(self, scFile, eventFile):
-        if eventFile is not None:
-            eventFiles = self._fileList(eventFile)
-            self._roiCuts.readCuts(eventFiles, 'EVENTS', False)
         tmin = self._roiCuts.minTime()
         tmax = self._roiCuts.maxTime()
         scFiles = self._fileList(scFile)
@@ -142,7 +188,11 @@ class UnbinnedObs(object):
             output.close()
 
 class UnbinnedAnalysis(AnalysisBase):
-    def __init__(self, observation, srcModel=None, optimizer='Drmngb', nee=21):
+    def __init__(self, observation, srcModel=None, optimizer='Drmngb', nee=21,
+                 responseCache=None):
+        """If responseCache is the name of a directory, the diffuse
+        source responses of the events are kept there and reused by later
+        analyses of the same data (see EventResponseCache)."""
         AnalysisBase.__init__(self)
         if srcModel is None:
             srcModel, optimizer = self._srcDialog()
@@ -151,8 +201,11 @@ class UnbinnedAnalysis(AnalysisBase):
         self.optimizer = optimizer
         self.logLike = pyLike.LogLike(self.observation.observation)
         self.logLike.initOutputStreams()
-        self.logLike.readXml(srcModel, _funcFactory, True, True, False)
-        self.logLike.computeEventResponses()
+        self.logLike.readXml(srcModel, funcFactory(), True, True, False)
+        if responseCache is None:
+            self.logLike.computeEventResponses()
+        else:
+            EventResponseCache(responseCache).computeEventResponses(self)
         self.model = SourceModel(self.logLike, srcModel)
         eMin, eMax = self.observation.roiCuts().getEnergyCuts()
         estep = num.log(eMax/eMin)/(nee-1)
@@ -13,6 +13,7 @@ import bisect
 import pyLikelihood as pyLike
 import numpy as num
 from LikelihoodState import LikelihoodState
+from ProfileLikelihood import ProfileLikelihood
 
 class QuadraticFit_np(object):
     """numpy.poly1d/polyfit based implemetation"""
@@ -106,8 +107,9 @@ class UpperLimit(object):
     def compute(self, emin=100, emax=3e5, delta=2.71/2., 
                 tmpfile='temp_model.xml', fix_src_pars=False,
                 verbosity=1, nsigmax=2, npts=5, renorm=False,
-                mindelta=1e-2, resample=False):
-        saved_state = LikelihoodState(self.like)
+                mindelta=1e-2, resample=False, cache=None):
+        saved_state = LikelihoodState(self.like, compact=True)
+        profile = self._profileLikelihood(cache)
         
         # Store the value of the covariance flag
         covar_is_current = self.like.covar_is_current
@@ -139,15 +141,17 @@ class UpperLimit(object):
 
         logLike0 = self.like()
         x0 = self.like[self.indx].getValue()
+        profile.store(x0, logLike0)
         dx, dlogLike_est = self._find_dx(self.normPar, normPar_error,
                                          nsigmax, renorm, 
-                                         logLike0, mindelta=mindelta)
+                                         logLike0, mindelta=mindelta,
+                                         profile=profile)
         while True:
             i, xvals, dlogLike, fluxes = \
                    self._sample_likelihood_profile(delta, dx, dlogLike_est,
                                                    nsigmax, npts, verbosity,
                                                    renorm, source, emin, emax,
-                                                   logLike0, x0)
+                                                   logLike0, x0, profile)
             if max(dlogLike) > 1e-2:
                 break
             dx *= 10
@@ -160,12 +164,11 @@ class UpperLimit(object):
             x = yfit.xval(1.1*delta)
             xvals.append(x)
             try:
-                self.like[self.indx] = x
+                negLogLike = self._profile(x, renorm, profile)
             except RuntimeError as message:
                 print (x)
                 raise RuntimeError(message)
-            self.fit(0, renorm=renorm)
-            dlogLike.append(self.like() - logLike0)
+            dlogLike.append(negLogLike - logLike0)
             fluxes.append(self.like[source].flux(emin, emax))
             yfit.add_pair(x, dlogLike[-1])
             i += 1
@@ -177,12 +180,11 @@ class UpperLimit(object):
             new_fluxes = []
             for i, x in enumerate(new_xvals):
                 try:
-                    self.like[self.indx] = x
+                    negLogLike = self._profile(x, renorm, profile)
                 except RuntimeError as message:
                     print (x)
                     raise RuntimeError(message)
-                self.fit(0, renorm=renorm)
-                new_dlogLike.append(self.like() - logLike0)
+                new_dlogLike.append(negLogLike - logLike0)
                 new_fluxes.append(self.like[source].flux(emin, emax))
                 if verbosity > 0:
                     print (i, x, new_dlogLike[-1], new_fluxes[-1])
@@ -216,9 +218,10 @@ class UpperLimit(object):
         self.like.covar_is_current = covar_is_current
         return ul, xx
     def scan(self, xmin=0, xmax=10, npts=50,
-             fix_src_pars=False, verbosity=1, renorm=False):
-        saved_state = LikelihoodState(self.like)
+             fix_src_pars=False, verbosity=1, renorm=False, cache=None):
+        saved_state = LikelihoodState(self.like, compact=True)
         source = self.source
+        profile = self._profileLikelihood(cache)
 
         # Fix the normalization parameter for the scan.
         self.like.freeze(self.indx)
@@ -233,9 +236,7 @@ class UpperLimit(object):
         xvals, dlogLike = [], []
         for i, x in enumerate(num.linspace(xmin, xmax, npts)):
             xvals.append(x)
-            self.like[self.indx] = x
-            self.fit(0, renorm=renorm)
-            dlogLike.append(self.like() - logLike0)
+            dlogLike.append(self._profile(x, renorm, profile) - logLike0)
             if verbosity > 0:
                 print (i, x, dlogLike[-1])
 
@@ -246,15 +247,38 @@ class UpperLimit(object):
         self.scanPars = xvals
         self.scanLike = dlogLike
         return xvals, dlogLike
-    def _logLike(self, xpar, renorm):
+    def _profileLikelihood(self, cache=None):
+        """Profile likelihood in the normalization parameter, using
+        the fit method for the nuisance parameters.  The last one
+        created is kept as self.profile so that its hit and miss
+        counts can be inspected."""
+        self.profile = ProfileLikelihood(self.like, self.source,
+                                         self.normPar.getName(),
+                                         cache=cache, optimize=self.fit)
+        return self.profile
+    def _logLike(self, xpar, renorm, profile=None):
         xmin, xmax = self.like[self.indx].getBounds()
         if xpar < xmin or xpar > xmax:
             raise RuntimeError("Attempt to set parameter value outside bounds.")
-        self.like[self.indx] = xpar
-        self.fit(0, renorm=renorm)
-        return self.like()
-    def _errorEst(self, renorm, verbosity=0):
-        saved_state = LikelihoodState(self.like)
+        if profile is None:
+            self.like[self.indx] = xpar
+            self.fit(0, renorm=renorm)
+            return self.like()
+        return self._profile(xpar, renorm, profile)
+    def _profile(self, x, renorm, profile):
+        """Set the normalization parameter to x and return the
+        -log-likelihood optimized over the other free parameters.
+        Renormalized fits depend on the current state of the model, so
+        are not memoized."""
+        if renorm:
+            self.like[self.indx] = x
+            self.fit(0, renorm=renorm)
+            return self.like()
+        return profile(x)
+    def _errorEst(self, renorm, verbosity=0, profile=None):
+        saved_state = LikelihoodState(self.like, compact=True)
+        if profile is None:
+            profile = self._profileLikelihood()
         logLike0 = saved_state.negLogLike
 
         # Store the value of the covariance flag
@@ -266,6 +290,7 @@ class UpperLimit(object):
 
         # Fix the normalization parameter for the scan.
         self.like.freeze(self.indx)
+        profile.store(x0, logLike0)
 
         # Set the lower bound to zero
         current_bounds = par.getBounds()
@@ -275,7 +300,7 @@ class UpperLimit(object):
         self.like[self.indx].setBounds(0, current_bounds[1])
 
         xvals = num.arange(x0, x0 + xsig*3, (xsig*3)/10.)
-        yvals = num.array([self._logLike(x, renorm) for x in xvals])
+        yvals = num.array([self._logLike(x, renorm, profile) for x in xvals])
         quadfit = QuadFit(xvals, yvals, xmin=x0)
         sigest = quadfit.errorEst()
 
@@ -285,13 +310,14 @@ class UpperLimit(object):
         return sigest
     def bayesianUL(self, cl=0.95, nsig=10, renorm=False, 
                    emin=100, emax=3e5, npts=50,
-                   verbosity=1):
-        saved_state = LikelihoodState(self.like)
+                   verbosity=1, cache=None):
+        saved_state = LikelihoodState(self.like, compact=True)
+        profile = self._profileLikelihood(cache)
 
         logLike0 = saved_state.negLogLike
         x0 = self.normPar.getValue()
         
-        errEst = self._errorEst(renorm)
+        errEst = self._errorEst(renorm, profile=profile)
         normPar_nsig = errEst*nsig
 
         # Store the value of the covariance flag
@@ -311,16 +337,18 @@ class UpperLimit(object):
         if x0 + normPar_nsig > current_bounds[1]:
             normPar_nsig = current_bounds[1] - x0
 
-        dlogLike_plus = (self._logLike(x0 + normPar_nsig, renorm)
+        dlogLike_plus = (self._logLike(x0 + normPar_nsig, renorm, profile)
                          - saved_state.negLogLike)
-        dlogLike_minus = (self._logLike(max(x0 - normPar_nsig, 0), renorm)
+        dlogLike_minus = (self._logLike(max(x0 - normPar_nsig, 0), renorm,
+                                        profile)
                           - saved_state.negLogLike)
 
         while dlogLike_plus < 10:
             normPar_nsig += 2*errEst
-            dlogLike_plus = (self._logLike(x0 + normPar_nsig, renorm)
+            dlogLike_plus = (self._logLike(x0 + normPar_nsig, renorm, profile)
                              - saved_state.negLogLike)
-            dlogLike_minus = (self._logLike(max(x0 - normPar_nsig, 0), renorm)
+            dlogLike_minus = (self._logLike(max(x0 - normPar_nsig, 0),
+                                            renorm, profile)
                               - saved_state.negLogLike)
 
         # Integrate from max(0, x0 - normPar_nsig)
@@ -329,7 +357,7 @@ class UpperLimit(object):
         xx, yy = [], []
         for i in range(npts+1):
             xx.append(xmin + dx*i)
-            yy.append(self._logLike(xx[-1], renorm) - logLike0)
+            yy.append(self._logLike(xx[-1], renorm, profile) - logLike0)
             
         # Compute likelihood = exp(-dlogLike) for integral
         x = num.array(xx)
@@ -356,8 +384,10 @@ class UpperLimit(object):
         return flux, xval
     def _sample_likelihood_profile(self, delta, dx, dlogLike_est,
                                    nsigmax, npts, verbosity, renorm, source,
-                                   emin, emax, logLike0, x0):
+                                   emin, emax, logLike0, x0, profile=None):
         xvals, dlogLike, fluxes = [], [], []
+        if profile is None:
+            profile = self._profileLikelihood()
         if verbosity > 1:
             print (self.like.model)
         #
@@ -367,9 +397,7 @@ class UpperLimit(object):
             npts = max(npts, 2.*nsigmax*dx/delta)
         for i, x in enumerate(num.arange(x0, x0+nsigmax*dx, nsigmax*dx/npts)):
             xvals.append(x)
-            self.like[self.indx] = x
-            self.fit(0, renorm=renorm)
-            dlogLike.append(self.like() - logLike0)
+            dlogLike.append(self._profile(x, renorm, profile) - logLike0)
             fluxes.append(self.like[source].flux(emin, emax))
             if verbosity > 0:
                 print (i, x, dlogLike[-1], fluxes[-1])
@@ -380,7 +408,7 @@ class UpperLimit(object):
                 break
         return i, xvals, dlogLike, fluxes
     def _find_dx(self, par, par_error, nsigmax, renorm, logLike0, 
-                 niter=3, factor=2, mindelta=1e-2):
+                 niter=3, factor=2, mindelta=1e-2, profile=None):
         """Find an initial dx such that the change in -log-likelihood 
         evaluated at x0 + dx (dlogLike) is larger than mindelta.  A very 
         small or even negative value can occur if x0 is not right
@@ -392,7 +420,8 @@ class UpperLimit(object):
         if dx == 0:
             dx = abs(par.getValue())
         for i in range(niter):
-            dlogLike = self._logLike(x0 + dx*nsigmax, renorm) - logLike0
+            dlogLike = (self._logLike(x0 + dx*nsigmax, renorm, profile)
+                        - logLike0)
             #print ("_find_dx:", dx, par.getValue(), dlogLike)
             if dlogLike > mindelta:
                 break
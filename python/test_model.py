@@ -5,8 +5,7 @@
 # $Header$
 
 import pyLikelihood as pyLike
-
-_funcFactory = pyLike.SourceFactory.funcFactory()
+from SrcModel import funcFactory
 
 def compare_floats(x, y, tol=1e-4):
     if x == 0:
@@ -16,7 +15,7 @@ def compare_floats(x, y, tol=1e-4):
 
 class DerivTester(object):
     def __init__(self, function):
-        self.func = _funcFactory.create(function)
+        self.func = funcFactory().create(function)
     def __call__(self, xval=100, verbose=0):
         x = pyLike.dArg(xval)
         y0 = self.func.value(x)
@@ -5,6 +5,7 @@
 #ifdef TRAP_FPE
 #include <fenv.h>
 #endif
+#include <algorithm>
 #include <cstddef>
   // Stuff from other packages
 #include "CLHEP/Random/RandFlat.h"
@@ -138,7 +139,9 @@
 #include "Likelihood/CountsSpectra.h"
   // Stuff in pyLikelihood
 #include "pyLikelihood/Aeff.h"
+#include "pyLikelihood/CallbackStatistic.h"
 #include "pyLikelihood/enableFPE.h"
+#include "pyLikelihood/ThreadedSummedLikelihood.h"
   // stl headers
 #include <vector>
 #include <string>
@@ -160,6 +163,55 @@ private:
    const std::string m_appName;
 };
 
+// Helpers for the BinnedLikelihood extensions.  The addresses of the
+// map data are only taken once the maps are known to be non-empty;
+// e.g., the source maps of fixed sources are emptied when
+// delete_local_fixed is set.
+static const float * binnedCountsData(Likelihood::BinnedLikelihood & like) {
+   const std::vector<float> & counts(like.countsMap().data());
+   if (counts.empty()) {
+      throw std::runtime_error("The counts map is empty.");
+   }
+   return &counts[0];
+}
+
+static const float * binnedSourceMapData(Likelihood::BinnedLikelihood & like,
+                                         const std::string & srcName) {
+   const std::vector<float> & model(like.sourceMap(srcName).model());
+   if (model.empty()) {
+      throw std::runtime_error("The source map of " + srcName
+                               + " is not in memory.");
+   }
+   return &model[0];
+}
+
+// Write the model counts of srcName into the (nebins, npix) array
+// model_counts, leaving zeros in the pixels with no counts.
+static void fillBinnedModelCounts(Likelihood::BinnedLikelihood & like,
+                                  const std::string & srcName,
+                                  double * model_counts) {
+   const Likelihood::Source * src(like.getSource(srcName));
+   const std::vector<double> & energies(like.energies());
+   size_t numpix(like.countsMap().pixels().size());
+   if (like.sourceMap(srcName).model().size()
+       < energies.size()*numpix) {
+      throw std::runtime_error("The source map of " + srcName
+                               + " does not match the counts map.");
+   }
+   const float * model(binnedSourceMapData(like, srcName));
+   const float * counts(binnedCountsData(like));
+   for (size_t k(0); k < energies.size() - 1; k++) {
+      double emin(energies[k]);
+      double emax(energies[k+1]);
+      for (size_t j(0), imin(k*numpix); j < numpix; j++, imin++) {
+         model_counts[imin] = 0;
+         if (counts[imin] > 0) {
+            model_counts[imin] = src->pixelCounts(emin, emax, model[imin],
+                                                  model[imin + numpix]);
+         }
+      }
+   }
+}
 
 using optimizers::Parameter;
 using optimizers::ParameterNotFound;
@@ -330,7 +382,9 @@ using optimizers::Exception;
 %include Likelihood/CountsSpectra.h
   // Stuff in pyLikelihood
 %include pyLikelihood/Aeff.h
+%include pyLikelihood/CallbackStatistic.h
 %include pyLikelihood/enableFPE.h
+%include pyLikelihood/ThreadedSummedLikelihood.h
 %extend Likelihood::LogLike {
    static void set_ScaleFactor_complement(optimizers::Function * func, 
                                           bool use_complement) {
@@ -540,34 +594,97 @@ using optimizers::Exception;
       self->getSrcNames(my_names);
       return my_names;
    }
+   std::vector<double> getSpectralParamData() {
+      // Pack (value, min, max, scale, free, error) for every spectral
+      // parameter, in source-name then parameter-name order.
+      std::vector<std::string> srcNames;
+      self->getSrcNames(srcNames);
+      std::vector<double> data;
+      for (size_t i(0); i < srcNames.size(); i++) {
+         Likelihood::Source::FuncMap srcFuncs
+            = self->getSource(srcNames[i])->getSrcFuncs();
+         optimizers::Function * spectrum(srcFuncs["Spectrum"]);
+         std::vector<std::string> parNames;
+         spectrum->getParamNames(parNames);
+         for (size_t j(0); j < parNames.size(); j++) {
+            const optimizers::Parameter * par(spectrum->getParam(parNames[j]));
+            std::pair<double, double> bounds(par->getBounds());
+            data.push_back(par->getValue());
+            data.push_back(bounds.first);
+            data.push_back(bounds.second);
+            data.push_back(par->getScale());
+            data.push_back(par->isFree() ? 1. : 0.);
+            data.push_back(par->error());
+         }
+      }
+      return data;
+   }
+   void setSpectralParamData(const std::vector<double> & data) {
+      std::vector<std::string> srcNames;
+      self->getSrcNames(srcNames);
+      size_t k(0);
+      for (size_t i(0); i < srcNames.size(); i++) {
+         Likelihood::Source::FuncMap srcFuncs
+            = self->getSource(srcNames[i])->getSrcFuncs();
+         optimizers::Function * spectrum(srcFuncs["Spectrum"]);
+         std::vector<std::string> parNames;
+         spectrum->getParamNames(parNames);
+         for (size_t j(0); j < parNames.size(); j++, k += 6) {
+            if (k + 6 > data.size()) {
+               throw std::runtime_error("Parameter data do not match "
+                                        "the current source model.");
+            }
+            // Update the existing Parameter field by field, so that the
+            // data not in the packed record (e.g., alwaysFixed, the
+            // prior) are left alone.  The bounds are first widened to
+            // include both the current and the restored values, since
+            // Parameter checks the value against its bounds.
+            optimizers::Parameter * par(spectrum->getParam(parNames[j]));
+            double value(data[k]);
+            double current(par->getValue());
+            par->setBounds(std::min(data[k+1], std::min(value, current)),
+                           std::max(data[k+2], std::max(value, current)));
+            par->setValue(value);
+            par->setBounds(data[k+1], data[k+2]);
+            par->setScale(data[k+3]);
+            par->setFree(data[k+4] != 0);
+            par->setError(data[k+5]);
+         }
+      }
+      if (k != data.size()) {
+         throw std::runtime_error("Parameter data do not match "
+                                  "the current source model.");
+      }
+      self->syncParams();
+   }
    optimizers::Mcmc * Mcmc() {
       return new optimizers::Mcmc(*self);
    }
 }
 %extend Likelihood::BinnedLikelihood {
+   void fillModelCounts(const std::string & srcName, size_t address) {
+      // Write the model counts of srcName into the (nebins, npix) array
+      // of doubles at address, e.g., the data of a numpy array.
+      fillBinnedModelCounts(*self, srcName,
+                            reinterpret_cast<double *>(address));
+   }
    std::vector<double> modelCounts(const std::string & srcName) {
-      const Likelihood::Source * src(self->getSource(srcName));
-      Likelihood::SourceMap & srcMap(self->sourceMap(srcName));
-      const std::vector<float> & model(srcMap.model());
-      const std::vector<float> & counts(self->countsMap().data());
-      const std::vector<double> & energies(self->energies());
-
       size_t numpix(self->countsMap().pixels().size());
-      std::vector<double> model_counts(numpix*(energies.size() - 1), 0);
-      for (size_t k(0); k < energies.size() - 1; k++) {
-         for (size_t j(0); j < numpix; j++) {
-            size_t imin(k*numpix + j);
-            if (counts.at(imin) > 0) {
-               size_t imax(imin + numpix);
-               model_counts.at(imin) += src->pixelCounts(energies.at(k),
-                                                         energies.at(k+1),
-                                                         model.at(imin),
-                                                         model.at(imax));
-            }
-         }
+      std::vector<double> model_counts(numpix*(self->energies().size() - 1));
+      if (!model_counts.empty()) {
+         fillBinnedModelCounts(*self, srcName, &model_counts[0]);
       }
       return model_counts;
    }
+   size_t countsMapAddress() {
+      return reinterpret_cast<size_t>(binnedCountsData(*self));
+   }
+   size_t sourceMapAddress(const std::string & srcName) {
+      return reinterpret_cast<size_t>(binnedSourceMapData(*self, srcName));
+   }
+   size_t sourceMapSize(const std::string & srcName) {
+      return self->sourceMap(srcName).model().size();
+   }
 }
 
 %extend optimizers::Minuit {
@@ -601,6 +718,32 @@ using optimizers::Exception;
    }
 }
 
+%extend Likelihood::EventContainer {
+   std::vector<double> getDiffuseResponses(const std::string & srcName) const {
+      const std::vector<Likelihood::Event> & events(self->events());
+      std::vector<double> responses;
+      responses.reserve(events.size());
+      for (size_t i(0); i < events.size(); i++) {
+         responses.push_back(events[i].diffuseResponse(events[i].getEnergy(),
+                                                       srcName));
+      }
+      return responses;
+   }
+   void setDiffuseResponses(const std::string & srcName,
+                            const std::vector<double> & responses) {
+      std::vector<Likelihood::Event> & events(self->events());
+      if (responses.size() != events.size()) {
+         throw std::runtime_error("EventContainer::setDiffuseResponses: "
+                                  "number of responses does not match "
+                                  "the number of events.");
+      }
+      for (size_t i(0); i < events.size(); i++) {
+         events[i].setDiffuseResponse(srcName,
+                                      std::vector<double>(1, responses[i]));
+      }
+   }
+}
+
 %extend Likelihood::DiffRespIntegrand {
    static astro::SkyDir srcDir(double mu, double phi, 
                                const Likelihood::EquinoxRotation eqRot) {
@@ -660,6 +803,32 @@ using optimizers::Exception;
       return *(self->begin() + i);
    }
 }
+%extend optimizers::Function {
+   std::vector<double> values(const std::vector<double> & x) const {
+      std::vector<double> y;
+      y.reserve(x.size());
+      for (size_t i(0); i < x.size(); i++) {
+         optimizers::dArg arg(x[i]);
+         y.push_back(self->value(arg));
+      }
+      return y;
+   }
+   std::vector<double>
+   derivsByParams(const std::vector<double> & x,
+                  const std::vector<std::string> & parNames) const {
+      // Derivatives with respect to each parameter in parNames at each
+      // x, as a row-major (parNames.size(), x.size()) matrix.
+      std::vector<double> derivs;
+      derivs.reserve(parNames.size()*x.size());
+      for (size_t j(0); j < parNames.size(); j++) {
+         for (size_t i(0); i < x.size(); i++) {
+            optimizers::dArg arg(x[i]);
+            derivs.push_back(self->derivByParam(arg, parNames[j]));
+         }
+      }
+      return derivs;
+   }
+}
 %extend optimizers::Parameter {
    void setEquals(const optimizers::Parameter & rhs) {
       self->operator=(rhs);